@@ -0,0 +1,4 @@
+"""
+Benchmarks for the please_reply hot paths.
+
+"""
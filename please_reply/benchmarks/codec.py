@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the user hash codec against the original per-character
+implementation.
+
+    python -m please_reply.benchmarks.codec [guests] [reply lists]
+
+"""
+import base64
+import random
+import sys
+import zlib
+from timeit import default_timer
+
+from please_reply.codec import encode_userhash, decode_userhash
+
+SALT = 's3cR3t547T'
+
+#-----------------------------------------------------------------------------
+# the codec as it was before keystreams were cached.
+
+def legacy_tinycode(key, text, reverse=False):
+    rand = random.Random(key).randrange
+    if not reverse:
+        text = zlib.compress(text)
+    text = ''.join([chr(ord(elem)^rand(256)) for elem in text])
+    if reverse:
+        text = zlib.decompress(text)
+    return text
+
+def legacy_encode_userhash(userpk, reply_list_id, salt):
+    reply_list_id = unicode(reply_list_id).replace("%%", "")
+    salt          = unicode(salt).replace("%%", "")
+
+    key = "%%".join([salt, reply_list_id])
+    return base64.urlsafe_b64encode(legacy_tinycode(key, str(userpk)))
+
+def legacy_decode_userhash(userhash, reply_list_id, salt):
+    reply_list_id = str(reply_list_id).replace("%%", "")
+    salt          = str(salt).replace("%%", "")
+
+    key = "%%".join([salt, reply_list_id])
+    userhash = base64.urlsafe_b64decode(str(userhash))
+    return legacy_tinycode(key, userhash, reverse=True)
+
+#-----------------------------------------------------------------------------
+# benchmark.
+
+def timed(func, args):
+    start = default_timer()
+    results = [func(*arg) for arg in args]
+    return default_timer() - start, results
+
+def run(guests=100000, replylists=10):
+    encode_args = [(userpk, userpk % replylists + 1, SALT)
+                   for userpk in range(1, guests + 1)]
+
+    report = []
+    for name, encode, decode in (
+            ('legacy', legacy_encode_userhash, legacy_decode_userhash),
+            ('codec', encode_userhash, decode_userhash)):
+
+        encode_time, hashes = timed(encode, encode_args)
+        decode_args = [(userhash, reply_list_id, salt)
+                       for userhash, (userpk, reply_list_id, salt)
+                       in zip(hashes, encode_args)]
+        decode_time, userpks = timed(decode, decode_args)
+
+        assert userpks == [str(arg[0]) for arg in encode_args]
+        report.append((name, encode_time, decode_time, hashes))
+
+    assert report[0][3] == report[1][3], "codec output differs from legacy"
+
+    for name, encode_time, decode_time, hashes in report:
+        sys.stdout.write("%-8s encode %8.3fs  decode %8.3fs  (%d guests)\n" %
+                         (name, encode_time, decode_time, guests))
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:]])
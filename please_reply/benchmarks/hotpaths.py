@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+Times the manager, codec and view hot paths and counts the queries they run,
+for guest lists of growing size.
+
+    python -m please_reply.benchmarks.hotpaths [options]
+
+    --sizes=10,1000,10000,100000    guest list sizes to run.
+    --samples=200                   operations timed per path and size.
+    --output=FILE                   write the results to FILE as JSON.
+    --baseline=FILE                 compare with results written earlier on
+                                    this machine and exit with 1 if any path
+                                    regressed. --baseline= skips the
+                                    comparison. Without it the query counts
+                                    are compared with baseline.json next to
+                                    this file.
+    --tolerance=0.25                slowdown allowed before a time from
+                                    --baseline counts as a regression, query
+                                    counts must not grow.
+
+Unless DJANGO_SETTINGS_MODULE is set the benchmarks configure an in-memory
+SQLite database themselves. Either way please_reply.tests has to be installed
+for its Event model, and a test database is created for the run.
+
+The committed baseline.json was recorded with the default options on SQLite.
+Its query counts hold anywhere, but timings depend on the machine, so only
+the query counts are checked against it. To check a change for slowdowns as
+well, record a baseline on your own machine before it:
+
+    python -m please_reply.benchmarks.hotpaths --baseline= --output=before.json
+    python -m please_reply.benchmarks.hotpaths --baseline=before.json
+
+"""
+import os
+import random
+import sys
+import tempfile
+from optparse import OptionParser
+from timeit import default_timer
+
+SALT = 's3cR3t547T'
+
+SIZES = (10, 1000, 10000, 100000)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+#-----------------------------------------------------------------------------
+# setup.
+
+def configure():
+    """
+    configure settings for a standalone run, unless a settings module is set.
+    """
+    from django.conf import settings
+
+    if settings.configured or os.environ.get('DJANGO_SETTINGS_MODULE'):
+        return
+
+    # the reply templates extend base.html.
+    template_dir = tempfile.mkdtemp()
+    base = open(os.path.join(template_dir, 'base.html'), 'w')
+    base.write('{% block content %}{% endblock %}')
+    base.close()
+
+    settings.configure(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': ':memory:'}},
+        INSTALLED_APPS=['django.contrib.contenttypes',
+                        'django.contrib.auth',
+                        'django.contrib.sessions',
+                        'please_reply.tests',
+                        'please_reply'],
+        ROOT_URLCONF='please_reply.urls',
+        TEMPLATE_DIRS=[template_dir],
+        PLEASE_REPLY_SECRET_SALT=SALT,
+    )
+
+def make_guests(size):
+    """
+    empty the please_reply tables and insert size new users.
+    """
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from please_reply.models import Reply, ReplyList, bulk_insert
+    from please_reply.tests.models import Event
+
+    cursor = connection.cursor()
+    for model in (Reply, ReplyList, Event, User):
+        cursor.execute('DELETE FROM %s' %
+                       connection.ops.quote_name(model._meta.db_table))
+    transaction.commit_unless_managed()
+
+    bulk_insert(User, [User(username='guest%d' % i,
+                            email='guest%d@example.com' % i)
+                       for i in xrange(size)])
+    return list(User.objects.all())
+
+#-----------------------------------------------------------------------------
+# measuring.
+
+def measure(name, size, func, args):
+    """
+    call func with each tuple of args, returning the time taken and the
+    queries run as a result dict.
+    """
+    from django.core.signals import request_started
+    from django.db import connection, reset_queries
+
+    old_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    # requests made by the test client would reset the query log.
+    request_started.disconnect(reset_queries)
+    reset_queries()
+    try:
+        start = default_timer()
+        for arg in args:
+            func(*arg)
+        seconds = default_timer() - start
+        queries = len(connection.queries)
+    finally:
+        connection.use_debug_cursor = old_debug_cursor
+        request_started.connect(reset_queries)
+        reset_queries()
+
+    ops = len(args)
+    return {
+        'name': name,
+        'guests': size,
+        'ops': ops,
+        'seconds': seconds,
+        'queries': queries,
+        'ms_per_op': seconds * 1000.0 / ops,
+        'queries_per_op': float(queries) / ops,
+    }
+
+def run_size(size, samples=200):
+    """
+    benchmark every path for a guest list of size guests.
+    """
+    from django.core.urlresolvers import reverse
+    from django.test.client import Client
+    from please_reply.codec import encode_userhash, decode_userhash
+    from please_reply.models import Reply, ReplyList
+    from please_reply.tests.models import Event
+    from please_reply.views.decorators import SECRET_SALT
+
+    guests = make_guests(size)
+    sample = random.Random(size).sample(guests, min(samples, size))
+
+    event = Event(title='benchmark %d' % size)
+    event.save()
+    bulk_event = Event(title='bulk benchmark %d' % size)
+    bulk_event.save()
+
+    results = [
+        measure('create_replylist', size,
+                ReplyList.objects.create_replylist, [(event, guests)]),
+        measure('bulk_create_replylist', size,
+                ReplyList.objects.bulk_create_replylist,
+                [(bulk_event, guests)]),
+    ]
+
+    replylist_id = ReplyList.objects.get_replylist_id_for(event)
+    hashes = [encode_userhash(guest.pk, replylist_id, SECRET_SALT)
+              for guest in sample]
+
+    results.extend([
+        measure('encode_userhash', size, encode_userhash,
+                [(guest.pk, replylist_id, SECRET_SALT) for guest in sample]),
+        measure('decode_userhash', size, decode_userhash,
+                [(userhash, replylist_id, SECRET_SALT)
+                 for userhash in hashes]),
+        measure('reply_to_event_for', size, Reply.objects.reply_to_event_for,
+                [(event, guest, i % 2 == 0)
+                 for i, guest in enumerate(sample)]),
+        measure('is_guest_attending', size,
+                ReplyList.objects.is_guest_attending,
+                [(event, guest) for guest in sample]),
+    ])
+
+    client = Client()
+    def get(urlname, **kwargs):
+        response = client.get(reverse(urlname, kwargs=kwargs))
+        assert response.status_code == 200, (urlname, response.status_code)
+
+    url_kwargs = [dict(slug=event.slug, reply_list_id=replylist_id,
+                       user_hash=userhash) for userhash in hashes]
+    results.extend([
+        measure('please_reply_reply_form', size,
+                lambda kwargs: get('please_reply_reply_form', **kwargs),
+                [(kwargs,) for kwargs in url_kwargs]),
+        measure('please_reply_replied', size,
+                lambda kwargs: get('please_reply_replied',
+                                   response='accept', **kwargs),
+                [(kwargs,) for kwargs in url_kwargs]),
+    ])
+
+    return results
+
+def run(sizes=SIZES, samples=200, out=None):
+    """
+    benchmark every size, writing a line per path to out as it goes.
+    """
+    import django
+
+    results = []
+    for size in sizes:
+        for result in run_size(size, samples):
+            results.append(result)
+            if out is not None:
+                out.write('%(name)-24s %(guests)7d guests %(ms_per_op)10.3fms '
+                          '%(queries_per_op)7.2f queries/op\n' % result)
+
+    return {
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'samples': samples,
+        'results': results,
+    }
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    return a message for each path and size that got slower than the baseline
+    by more than tolerance, or runs more queries than it did. timings aren't
+    compared when tolerance is None.
+    """
+    old_results = dict(((result['name'], result['guests']), result)
+                       for result in baseline['results'])
+
+    regressions = []
+    for result in results['results']:
+        old = old_results.get((result['name'], result['guests']))
+        if old is None:
+            continue
+
+        if result['queries_per_op'] > old['queries_per_op']:
+            regressions.append(
+                '%s (%d guests): %.2f queries/op, was %.2f' % (
+                    result['name'], result['guests'],
+                    result['queries_per_op'], old['queries_per_op']))
+
+        if (tolerance is not None and
+                result['ms_per_op'] > old['ms_per_op'] * (1 + tolerance)):
+            regressions.append(
+                '%s (%d guests): %.3fms/op, was %.3fms' % (
+                    result['name'], result['guests'],
+                    result['ms_per_op'], old['ms_per_op']))
+
+    return regressions
+
+#-----------------------------------------------------------------------------
+# command line.
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default=','.join(str(s) for s in SIZES))
+    parser.add_option('--samples', type='int', default=200)
+    parser.add_option('--output')
+    parser.add_option('--baseline')
+    parser.add_option('--tolerance', type='float', default=0.25)
+    options, args = parser.parse_args(argv)
+
+    configure()
+
+    from django.db import connection
+    from django.utils import simplejson
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run([int(size) for size in options.sizes.split(',')],
+                      options.samples, out=sys.stdout)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if options.output:
+        output = open(options.output, 'w')
+        simplejson.dump(results, output, indent=2, sort_keys=True,
+                        separators=(',', ': '))
+        output.write('\n')
+        output.close()
+
+    baseline_file, tolerance = options.baseline, options.tolerance
+    if baseline_file is None:
+        # the committed timings were taken on another machine.
+        baseline_file, tolerance = BASELINE, None
+
+    if baseline_file:
+        baseline = simplejson.load(open(baseline_file))
+        regressions = compare(results, baseline, tolerance)
+        for regression in regressions:
+            sys.stdout.write('REGRESSION %s\n' % regression)
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
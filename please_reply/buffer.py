@@ -0,0 +1,240 @@
+"""
+Buffers guests' replies so that reply clicks don't each write to the replies
+table, e.g. straight after a large mailing.
+
+With PLEASE_REPLY_REPLY_BUFFER set, the generic reply handlers only record
+the reply in the buffer. Reply.objects.flush_buffered_replies (or the
+flush_replies management command, run regularly) later writes the last
+reply of each guest with one UPDATE per reply list and reply. The setting
+may be the name of a cache from CACHES shared by all processes, or 'local'
+for a buffer in the memory of the current process. A locmem cache is kept
+per process too and is treated like 'local'; the dummy cache would lose
+every reply and is refused.
+
+A 'local' buffer can only be flushed from inside the process that holds it,
+so flush_replies refuses it: the process has to call
+flush_buffered_replies itself, e.g. from a timer thread. Replies still in it
+when the process exits are lost.
+
+"""
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+from please_reply import settings as backup_settings
+
+#-----------------------------------------------------------------------------
+# settings.
+
+BUFFER_NAME = getattr(
+                settings,
+               'PLEASE_REPLY_REPLY_BUFFER',
+                backup_settings.PLEASE_REPLY_REPLY_BUFFER)
+
+BUFFER_TIMEOUT = getattr(
+                settings,
+               'PLEASE_REPLY_REPLY_BUFFER_TIMEOUT',
+                backup_settings.PLEASE_REPLY_REPLY_BUFFER_TIMEOUT)
+
+#-----------------------------------------------------------------------------
+# buffers.
+
+class ReplyBuffer(object):
+    """
+    Records replies as {fieldname: value} dicts per (replylist_id, guest_id).
+
+    This base class is the disabled buffer: nothing is recorded or pending.
+
+    shared buffers can be flushed by another process, e.g. flush_replies.
+    """
+    enabled = False
+    shared = False
+
+    def add(self, replylist_id, guest_id, values):
+        """
+        Record the latest reply of a guest.
+        """
+
+    def pending_many(self, replylist_id, guest_ids):
+        """
+        Return {guest_id: values} for the guests with a buffered reply.
+        """
+        return {}
+
+    def pending(self, replylist_id, guest_id):
+        return self.pending_many(replylist_id, [guest_id]).get(guest_id)
+
+    def apply_pending(self, reply):
+        """
+        Set the buffered reply, if any, on a Reply instance.
+        """
+        values = self.pending(reply.replylist_id, reply.guest_id)
+        for fieldname, value in (values or {}).items():
+            setattr(reply, fieldname, value)
+        return reply
+
+    def drain(self):
+        """
+        Return a list of (replylist_id, guest_id, values) holding the last
+        buffered reply of each guest. They stay pending until passed to done.
+        """
+        return []
+
+    def done(self, replies):
+        """
+        Forget replies returned by drain once they have been written.
+        """
+
+class LocalReplyBuffer(ReplyBuffer):
+    """
+    Buffers replies in the memory of the current process, which has to
+    flush them itself.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.lock = Lock()
+        self.replies = {}
+
+    def add(self, replylist_id, guest_id, values):
+        with self.lock:
+            self.replies[(replylist_id, guest_id)] = values
+
+    def pending_many(self, replylist_id, guest_ids):
+        replies = self.replies
+        return dict((guest_id, replies[(replylist_id, guest_id)])
+                    for guest_id in guest_ids
+                    if (replylist_id, guest_id) in replies)
+
+    def drain(self):
+        with self.lock:
+            return [key + (values,) for key, values in self.replies.items()]
+
+    def done(self, replies):
+        with self.lock:
+            for replylist_id, guest_id, values in replies:
+                # keep replies that arrived while writing.
+                if self.replies.get((replylist_id, guest_id)) is values:
+                    del self.replies[(replylist_id, guest_id)]
+
+class CacheReplyBuffer(ReplyBuffer):
+    """
+    Buffers replies in a Django cache shared between processes.
+
+    Each reply is stored under a sequence number from cache.incr, and as the
+    pending reply of its guest. drain reads the sequence numbers since the
+    last flush.
+    """
+    enabled = True
+    shared = True
+
+    SEQUENCE_KEY = 'please_reply.buffer.sequence'
+    FLUSHED_KEY = 'please_reply.buffer.flushed'
+    STALLED_KEY = 'please_reply.buffer.stalled'
+
+    def __init__(self, cache, timeout=BUFFER_TIMEOUT, batch_size=500,
+                 shared=True):
+        self.cache = cache
+        self.shared = shared
+        self.timeout = timeout
+        self.batch_size = batch_size
+
+    def reply_key(self, number):
+        return 'please_reply.buffer.reply.%d' % number
+
+    def pending_key(self, replylist_id, guest_id):
+        return 'please_reply.buffer.pending.%s.%s' % (replylist_id, guest_id)
+
+    def add(self, replylist_id, guest_id, values):
+        self.cache.add(self.SEQUENCE_KEY, 0, self.timeout)
+        number = self.cache.incr(self.SEQUENCE_KEY)
+        self.cache.set_many({
+            self.reply_key(number): (replylist_id, guest_id, values),
+            self.pending_key(replylist_id, guest_id): (number, values),
+        }, self.timeout)
+
+    def pending_many(self, replylist_id, guest_ids):
+        keys = dict((self.pending_key(replylist_id, guest_id), guest_id)
+                    for guest_id in guest_ids)
+        return dict((keys[key], values) for key, (number, values)
+                    in self.cache.get_many(keys.keys()).items())
+
+    def drain(self):
+        flushed = self.cache.get(self.FLUSHED_KEY) or 0
+        last = self.cache.get(self.SEQUENCE_KEY) or 0
+        if last < flushed:
+            # the sequence expired and started again.
+            flushed = 0
+
+        latest = {}
+        self._drained_numbers = []
+        number = flushed
+        while number < last:
+            numbers = range(number + 1, min(last, number + self.batch_size) + 1)
+            found = self.cache.get_many(
+                    [self.reply_key(n) for n in numbers])
+
+            for n in numbers:
+                reply = found.get(self.reply_key(n))
+                if reply is None and not self._skip_missing(n):
+                    # a reply is being added, stop before it.
+                    return self._drained(latest, n - 1)
+                if reply is not None:
+                    replylist_id, guest_id, values = reply
+                    latest[(replylist_id, guest_id)] = (n, values)
+                    self._drained_numbers.append(n)
+                number = n
+
+        return self._drained(latest, number)
+
+    def _skip_missing(self, number):
+        """
+        A reply missing from the sequence is normally still being added, and
+        is waited for once. If it is still missing at the next drain it was
+        lost, e.g. evicted, and is skipped.
+        """
+        if self.cache.get(self.STALLED_KEY) == number:
+            return True
+        self.cache.set(self.STALLED_KEY, number, self.timeout)
+        return False
+
+    def _drained(self, latest, upto):
+        replies = [(replylist_id, guest_id, values)
+                   for (replylist_id, guest_id), (n, values)
+                   in latest.items()]
+        self._draining = (upto, latest)
+        return replies
+
+    def done(self, replies):
+        upto, latest = self._draining
+        pending = self.cache.get_many(
+                [self.pending_key(*key) for key in latest])
+
+        stale = [self.reply_key(n) for n in self._drained_numbers]
+        for key, (n, values) in latest.items():
+            pending_key = self.pending_key(*key)
+            # keep replies that arrived while writing.
+            if pending.get(pending_key, (0,))[0] <= upto:
+                stale.append(pending_key)
+
+        self.cache.delete_many(stale)
+        self.cache.set(self.FLUSHED_KEY, upto, self.timeout)
+
+def get_reply_buffer(name):
+    if not name:
+        return ReplyBuffer()
+    if name == 'local':
+        return LocalReplyBuffer()
+
+    cache = get_cache(name)
+    if isinstance(cache, DummyCache):
+        raise ImproperlyConfigured("PLEASE_REPLY_REPLY_BUFFER is a dummy "
+                                   "cache, which would lose every reply.")
+    # a locmem cache only lives in this process, like a 'local' buffer.
+    return CacheReplyBuffer(cache, shared=not isinstance(cache, LocMemCache))
+
+reply_buffer = get_reply_buffer(BUFFER_NAME)
@@ -0,0 +1,104 @@
+"""
+Caches the ReplyList id for each event so that the manager methods don't
+have to look the replylist up on every call.
+
+The cache is disabled unless PLEASE_REPLY_REPLYLIST_CACHE names a cache from
+CACHES (or a cache backend uri), e.g.
+
+    PLEASE_REPLY_REPLYLIST_CACHE = 'default'
+
+"""
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from please_reply import settings as backup_settings
+
+#-----------------------------------------------------------------------------
+# settings.
+
+CACHE_NAME = getattr(
+                settings,
+               'PLEASE_REPLY_REPLYLIST_CACHE',
+                backup_settings.PLEASE_REPLY_REPLYLIST_CACHE)
+
+CACHE_TIMEOUT = getattr(
+                settings,
+               'PLEASE_REPLY_REPLYLIST_CACHE_TIMEOUT',
+                backup_settings.PLEASE_REPLY_REPLYLIST_CACHE_TIMEOUT)
+
+NEGATIVE_CACHE_TIMEOUT = getattr(
+                settings,
+               'PLEASE_REPLY_REPLYLIST_NEGATIVE_CACHE_TIMEOUT',
+                backup_settings.PLEASE_REPLY_REPLYLIST_NEGATIVE_CACHE_TIMEOUT)
+
+#-----------------------------------------------------------------------------
+# cache.
+
+# stored for events that have no replylist; replylist ids are never 0.
+NO_REPLYLIST = 0
+
+class ReplyListCache(object):
+    """
+    Maps (content_type_id, object_id) of an event to the id of its ReplyList.
+
+    get returns None on a miss and NO_REPLYLIST for events known to have no
+    replylist. Hits and misses are counted per process.
+    """
+
+    def __init__(self, cache=None, timeout=CACHE_TIMEOUT,
+                 negative_timeout=NEGATIVE_CACHE_TIMEOUT):
+        self.cache = cache
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, content_type_id, object_id):
+        # object_id can be any text, hash it to get a safe cache key.
+        object_id = md5(unicode(object_id).encode('utf-8')).hexdigest()
+        return 'please_reply.replylist.%s.%s' % (content_type_id, object_id)
+
+    def get(self, content_type_id, object_id):
+        if self.cache is None:
+            return None
+
+        replylist_id = self.cache.get(self.key(content_type_id, object_id))
+        if replylist_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return replylist_id
+
+    def set(self, content_type_id, object_id, replylist_id):
+        if self.cache is not None:
+            self.cache.set(self.key(content_type_id, object_id),
+                           replylist_id, self.timeout)
+
+    def set_missing(self, content_type_id, object_id):
+        if self.cache is not None:
+            self.cache.set(self.key(content_type_id, object_id),
+                           NO_REPLYLIST, self.negative_timeout)
+
+    def delete(self, content_type_id, object_id):
+        if self.cache is not None:
+            self.cache.delete(self.key(content_type_id, object_id))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        self.hits = self.misses = 0
+
+replylist_cache = ReplyListCache(get_cache(CACHE_NAME) if CACHE_NAME else None)
+
+#-----------------------------------------------------------------------------
+# signal handlers.
+
+def replylist_saved(sender, instance, **kwargs):
+    replylist_cache.set(instance.content_type_id, instance.object_id,
+                        instance.pk)
+
+def replylist_deleted(sender, instance, **kwargs):
+    replylist_cache.delete(instance.content_type_id, instance.object_id)
@@ -0,0 +1,192 @@
+"""
+Encodes a guest's primary key into the user hash used in reply uris.
+
+"""
+import random
+import zlib
+import base64
+import hmac
+from binascii import hexlify, unhexlify
+from hashlib import sha256
+from time import time
+
+from please_reply.exceptions import InvalidHash
+
+# first field of a signed token, lets the format change later.
+TOKEN_VERSION = '1'
+
+# number of hex digits of the HMAC kept in a signed token.
+TOKEN_SIGNATURE_LENGTH = 20
+
+# number of (salt, reply_list_id) keys per keystream cache generation.
+KEYSTREAM_CACHE_SIZE = 1024
+
+_keystreams = {}
+_old_keystreams = {}
+
+def tinycode(key, text, reverse=False):
+    """
+    an XOR type encryption routine taken from 
+    http://code.activestate.com/recipes/266586-simple-xor-keyword-encryption/
+
+    This isn't a secure technique, I am only using it to slightly obscure an
+    otherwise obvious use of user.id in the uri. I know I could use a UUID for
+    this purpose, but I didn't want to add uuid as a dependancy for this
+    project.
+
+    The recipe XORs each character with the next random.Random(key).randrange(256)
+    value. That sequence only depends on the key, so it is generated once per
+    key (see keystream) and XORed with the whole text at once.
+    """
+    if not reverse:
+        text = zlib.compress(text)
+    text = xor(text, keystream(key, len(text)))
+    if reverse:
+        text = zlib.decompress(text)
+    return text
+
+def keystream(key, length):
+    """
+    Return the first length bytes the recipe would XOR with for key.
+
+    Keystreams are cached in two generations of at most KEYSTREAM_CACHE_SIZE
+    keys each: when the newest generation is full it replaces the oldest,
+    and keys used from the old generation are moved into the new one, so
+    the least recently used keys are the ones dropped.
+    """
+    global _keystreams, _old_keystreams
+
+    stream = _keystreams.get(key)
+    if stream is not None and len(stream) >= length:
+        return stream[:length]
+
+    stream = _old_keystreams.get(key)
+    if stream is None or len(stream) < length:
+        # randrange(256) is int(random() * 256) for a range this small.
+        rand = random.Random(key).random
+        stream = ''.join([chr(int(rand() * 256)) for i in range(length)])
+
+    if len(_keystreams) >= KEYSTREAM_CACHE_SIZE:
+        _old_keystreams, _keystreams = _keystreams, {}
+    _keystreams[key] = stream
+
+    return stream
+
+def xor(text, stream):
+    """
+    XOR two byte strings of the same length as two big integers.
+    """
+    if not text:
+        return text
+    value = int(hexlify(text), 16) ^ int(hexlify(stream), 16)
+    return unhexlify('%0*x' % (2 * len(text), value))
+
+def decode_userhash(userhash, reply_list_id, salt):
+    """
+    Decode and return the user-pk value.
+    Assume the unhashed text has the form:
+
+    userpk.
+
+    and was generated with key
+
+    salt%%reply_list_id
+
+    we are in big trouble if salt has %% in it!!.
+    so we assume they are not present.
+    """
+
+    reply_list_id = str(reply_list_id).replace("%%", "")
+    salt          = str(salt).replace("%%", "")
+
+    key = "%%".join([salt, reply_list_id])
+    try:
+        userhash = base64.urlsafe_b64decode(str(userhash))
+    except TypeError:
+        raise InvalidHash('hash %s was not valid' % userhash)
+    try:
+        return tinycode(key, userhash, reverse=True)
+    except zlib.error:
+        raise InvalidHash('attempted to decrypt %s with invalid key %s' %
+                                (userhash, key))
+    
+def encode_userhash(userpk, reply_list_id, salt):
+    """
+    Return a base64 XOR encrypted text using a key of:
+
+    salt%%reply_list_id
+
+    where any '%%' has been removed from salt and reply_list_id
+    """
+
+    reply_list_id = unicode(reply_list_id).replace("%%", "")
+    salt          = unicode(salt).replace("%%", "")
+
+    key = "%%".join([salt, reply_list_id])
+
+    userhash = tinycode(key, str(userpk))
+    return base64.urlsafe_b64encode(userhash)
+
+def encode_token(userpk, reply_list_id, secret, expires=None):
+    """
+    Return a signed token carrying reply_list_id and the integer userpk, and
+    optionally the unix time it expires at:
+
+        1_<reply_list_id>_<userpk>[_<expires>]_<signature>
+
+    numbers are written in base 36 and the signature is a truncated
+    HMAC-SHA256 of the rest of the token, keyed with secret.
+    """
+    fields = [reply_list_id, userpk]
+    if expires is not None:
+        fields.append(int(expires))
+
+    payload = '_'.join([TOKEN_VERSION] + [base36(int(f)) for f in fields])
+    return '%s_%s' % (payload, _token_signature(payload, secret))
+
+def decode_token(token, secret, now=None):
+    """
+    Return (reply_list_id, userpk) from a token made by encode_token.
+
+    Raises InvalidHash for malformed, forged or expired tokens.
+    """
+    try:
+        token = str(token)
+    except UnicodeEncodeError:
+        raise InvalidHash('token %r was not valid' % token)
+
+    fields = token.split('_')
+    if len(fields) not in (4, 5) or fields[0] != TOKEN_VERSION:
+        raise InvalidHash('token %s was not valid' % token)
+
+    payload, signature = token[:-len(fields[-1]) - 1], fields[-1]
+    if not hmac.compare_digest(signature, _token_signature(payload, secret)):
+        raise InvalidHash('token %s has an invalid signature' % token)
+
+    try:
+        numbers = [int(field, 36) for field in fields[1:-1]]
+    except ValueError:
+        raise InvalidHash('token %s was not valid' % token)
+
+    if len(numbers) == 3 and numbers[2] < (now or time()):
+        raise InvalidHash('token %s has expired' % token)
+
+    return numbers[0], numbers[1]
+
+def _token_signature(payload, secret):
+    return hmac.new(str(secret), payload, sha256
+                    ).hexdigest()[:TOKEN_SIGNATURE_LENGTH]
+
+def base36(number):
+    """
+    Write a non-negative integer in base 36.
+    """
+    if number < 0:
+        raise ValueError('%s is negative' % number)
+
+    digits = []
+    while True:
+        number, digit = divmod(number, 36)
+        digits.append('0123456789abcdefghijklmnopqrstuvwxyz'[digit])
+        if not number:
+            return ''.join(reversed(digits))
@@ -0,0 +1,83 @@
+"""
+Streams the replies of a reply list as CSV or JSON lines, e.g. for caterers
+or badge printing.
+
+"""
+import csv
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.datastructures import SortedDict
+
+from please_reply import settings as backup_settings
+
+#-----------------------------------------------------------------------------
+# settings.
+
+EXPORT_FIELDS = getattr(
+                settings,
+               'PLEASE_REPLY_EXPORT_FIELDS',
+                backup_settings.PLEASE_REPLY_EXPORT_FIELDS)
+
+#-----------------------------------------------------------------------------
+# export.
+
+def iter_reply_values(replylist, fields=EXPORT_FIELDS, chunk_size=1000):
+    """
+    Yield a dict of fields for each reply on replylist.
+
+    Replies are read chunk_size at a time in primary key order with
+    values(), so no model instances are built and memory stays flat.
+    """
+    replies = replylist.replies.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = replies
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk.values('pk', *fields)[:chunk_size])
+
+        for row in chunk:
+            yield row
+
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1]['pk']
+
+def iter_csv(replylist, fields=EXPORT_FIELDS, chunk_size=1000):
+    """
+    Yield the replies on replylist as lines of CSV, after a header line.
+    """
+    buf = StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        writer.writerow([_csv_value(value) for value in values])
+        text = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return text
+
+    yield line(fields)
+    for row in iter_reply_values(replylist, fields, chunk_size):
+        yield line([row[field] for field in fields])
+
+def iter_jsonl(replylist, fields=EXPORT_FIELDS, chunk_size=1000):
+    """
+    Yield the replies on replylist as JSON objects, one per line.
+    """
+    encoder = DjangoJSONEncoder()
+    for row in iter_reply_values(replylist, fields, chunk_size):
+        yield encoder.encode(SortedDict((field, row[field])
+                                        for field in fields)) + '\n'
+
+def _csv_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,205 @@
+"""
+Measures calls to the please_reply manager methods, the user hash decoding
+and the reply views, to find out where the time of a slow RSVP page goes.
+
+Instrumentation is off unless PLEASE_REPLY_INSTRUMENTATION names a sink:
+
+    'signal'    send the call_measured signal for each call.
+    'logging'   log each call to the please_reply.instrument logger.
+    'stats'     keep the timings in memory, see StatsSink.
+    or the dotted path of a class with a record method, e.g.
+
+        PLEASE_REPLY_INSTRUMENTATION = 'myproject.metrics.StatsdSink'
+
+For each call the sink is given the name of the call, its wall time in
+seconds, the number of queries it ran and, where it makes sense, the number
+of rows it returned or changed (None otherwise). While no sink is set an
+instrumented call costs one extra function call.
+
+"""
+import logging
+from collections import deque
+from functools import wraps
+from threading import Lock
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+from please_reply import settings as backup_settings
+
+#-----------------------------------------------------------------------------
+# settings.
+
+INSTRUMENTATION = getattr(
+                settings,
+               'PLEASE_REPLY_INSTRUMENTATION',
+                backup_settings.PLEASE_REPLY_INSTRUMENTATION)
+
+STATS_SAMPLES = getattr(
+                settings,
+               'PLEASE_REPLY_INSTRUMENTATION_SAMPLES',
+                backup_settings.PLEASE_REPLY_INSTRUMENTATION_SAMPLES)
+
+#-----------------------------------------------------------------------------
+# sinks.
+
+call_measured = Signal(providing_args=['seconds', 'queries', 'rows'])
+
+class SignalSink(object):
+    """
+    Sends call_measured with the name of the call as the sender.
+    """
+
+    def record(self, name, seconds, queries, rows):
+        call_measured.send(sender=name, seconds=seconds, queries=queries,
+                           rows=rows)
+
+class LoggingSink(object):
+    """
+    Logs a line per call at DEBUG level.
+    """
+
+    def __init__(self, logger='please_reply.instrument'):
+        self.logger = logging.getLogger(logger)
+
+    def record(self, name, seconds, queries, rows):
+        self.logger.debug('%s %.3fms %d queries %s rows',
+                          name, seconds * 1000, queries, rows)
+
+class StatsSink(object):
+    """
+    Keeps the last samples calls of each name in memory.
+
+        >>> stats.percentiles('ReplyListManager.get_replylist_for')
+        {50: 0.0004, 90: 0.0011, 99: 0.0023}
+        >>> stats.summary()
+        {'ReplyListManager.get_replylist_for':
+            {'calls': 120, 'seconds': 0.08, 'queries': 12, 'rows': 0,
+             'percentiles': {50: 0.0004, 90: 0.0011, 99: 0.0023}}, ...}
+    """
+
+    def __init__(self, samples=STATS_SAMPLES):
+        self.samples = samples
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.timings = {}
+
+    def record(self, name, seconds, queries, rows):
+        self.lock.acquire()
+        try:
+            if name not in self.calls:
+                self.calls[name] = {'calls': 0, 'seconds': 0.0,
+                                    'queries': 0, 'rows': 0}
+                self.timings[name] = deque(maxlen=self.samples)
+
+            calls = self.calls[name]
+            calls['calls'] += 1
+            calls['seconds'] += seconds
+            calls['queries'] += queries
+            calls['rows'] += rows or 0
+            self.timings[name].append(seconds)
+        finally:
+            self.lock.release()
+
+    def percentiles(self, name, percents=(50, 90, 99)):
+        """
+        the call times of name (in seconds) at each percent, from the last
+        samples calls.
+        """
+        timings = sorted(self.timings.get(name, ()))
+        if not timings:
+            return {}
+
+        return dict((percent, timings[min(len(timings) - 1,
+                                          len(timings) * percent // 100)])
+                    for percent in percents)
+
+    def summary(self):
+        summary = {}
+        for name, calls in self.calls.items():
+            summary[name] = dict(calls, percentiles=self.percentiles(name))
+        return summary
+
+def get_sink(name):
+    if not name:
+        return None
+    if name == 'signal':
+        return SignalSink()
+    if name == 'logging':
+        return LoggingSink()
+    if name == 'stats':
+        return StatsSink()
+    module_name, class_name = name.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)()
+
+sink = get_sink(INSTRUMENTATION)
+
+def set_sink(new_sink):
+    """
+    Start sending measurements to new_sink, or stop with None.
+    """
+    global sink
+    sink = new_sink
+
+#-----------------------------------------------------------------------------
+# measuring.
+
+def instrumented(name, rows=None):
+    """
+    decorates a function so each call to it is measured while a sink is set.
+
+    rows is an optional function that counts the rows of the call's result.
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if sink is None:
+                return func(*args, **kwargs)
+            return measure(name, rows, func, args, kwargs)
+
+        return inner
+
+    return decorator
+
+def measure(name, rows, func, args, kwargs):
+    # queries are only logged by a debug cursor; when one is switched on
+    # just for this call its queries are dropped from the log afterwards.
+    old_debug_cursor = connection.use_debug_cursor
+    was_logging = old_debug_cursor or (old_debug_cursor is None and
+                                       settings.DEBUG)
+    connection.use_debug_cursor = True
+    logged = len(connection.queries)
+    start = default_timer()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        seconds = default_timer() - start
+        queries = len(connection.queries) - logged
+        connection.use_debug_cursor = old_debug_cursor
+        if not was_logging:
+            del connection.queries[logged:]
+
+    current_sink = sink
+    if current_sink is not None:
+        current_sink.record(name, seconds, queries,
+                            rows(result) if rows is not None else None)
+    return result
+
+def instrument_methods(cls, methods):
+    """
+    instrument methods of cls, named '<class name>.<method name>'.
+
+    methods maps each method name to its rows function, or None.
+    """
+    for method_name, rows in methods.items():
+        name = '%s.%s' % (cls.__name__, method_name)
+        setattr(cls, method_name,
+                instrumented(name, rows)(cls.__dict__[method_name]))
@@ -0,0 +1,300 @@
+"""
+Builds the reply links for the guests of a reply list, and sends the
+invitation emails that carry them.
+
+"""
+import os
+import threading
+import Queue
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage, get_connection
+from django.core.urlresolvers import reverse
+from django.template import Context
+from django.template.loader import get_template
+
+from please_reply import settings as backup_settings
+from please_reply.models import Reply
+from please_reply.userhash import make_userhash
+
+#-----------------------------------------------------------------------------
+# settings.
+
+SECRET_SALT = getattr(
+                settings,
+               'PLEASE_REPLY_SECRET_SALT',
+                backup_settings.PLEASE_REPLY_SECRET_SALT)
+
+# stands in for the user hash while reversing urls, it must match [-=\w]+.
+USER_HASH_PLACEHOLDER = 'USER-HASH-PLACEHOLDER'
+
+#-----------------------------------------------------------------------------
+# links.
+
+class InvitationLinks(object):
+    """
+    The reply links of one reply list.
+
+    Each url is reversed once with a placeholder user hash, and only the user
+    hash is filled in per guest.
+
+    Links are made absolute with base_url, e.g. 'https://example.com', which
+    defaults to the domain of the current Site. Pass '' for bare paths.
+    """
+
+    def __init__(self, replylist, responses=('accept', 'decline'),
+                 slug_field='slug', salt=SECRET_SALT, base_url=None):
+        self.replylist = replylist
+        self.salt = salt
+
+        if base_url is None:
+            base_url = site_base_url()
+        base_url = base_url.rstrip('/')
+
+        url_kwargs = {
+            'slug': getattr(replylist.content_object, slug_field),
+            'reply_list_id': replylist.pk,
+            'user_hash': USER_HASH_PLACEHOLDER,
+        }
+
+        self.form_url = base_url + reverse('please_reply_reply_form',
+                                           kwargs=url_kwargs)
+        self.response_urls = []
+        for response in responses:
+            self.response_urls.append((response,
+                    base_url + reverse('please_reply_replied',
+                            kwargs=dict(url_kwargs, response=response))))
+
+    def for_guest(self, guest_pk):
+        """
+        Return (form_url, response_urls) for a guest, where response_urls maps
+        each response to its reply url.
+        """
+        user_hash = make_userhash(guest_pk, self.replylist.pk, self.salt)
+        return (self.form_url.replace(USER_HASH_PLACEHOLDER, user_hash),
+                dict((response, url.replace(USER_HASH_PLACEHOLDER, user_hash))
+                     for response, url in self.response_urls))
+
+def site_base_url():
+    """
+    'http://<domain>' of the current Site.
+    """
+    from django.contrib.sites.models import Site
+
+    if not Site._meta.installed:
+        raise ImproperlyConfigured("Pass base_url for invitation links, or "
+                                   "install django.contrib.sites.")
+    return 'http://%s' % Site.objects.get_current().domain
+
+def iter_invitation_links(replylist, responses=('accept', 'decline'),
+                          replies=None, slug_field='slug', salt=SECRET_SALT,
+                          chunk_size=1000, base_url=None):
+    """
+    Yield (guest_pk, form_url, response_urls) for each reply on replylist,
+    where response_urls maps each of responses to its reply url.
+
+    Replies are read chunk_size at a time in primary key order, so memory use
+    doesn't grow with the list. Pass replies to only include some of them,
+    e.g. Reply.not_responded.all(). The urls start with base_url, see
+    InvitationLinks.
+    """
+    links = InvitationLinks(replylist, responses, slug_field, salt, base_url)
+
+    for chunk in iter_reply_chunks(replylist, ('guest',), replies, chunk_size):
+        for reply_pk, guest_pk in chunk:
+            form_url, response_urls = links.for_guest(guest_pk)
+            yield guest_pk, form_url, response_urls
+
+def iter_reply_chunks(replylist, fields, replies=None, chunk_size=1000):
+    """
+    Yield lists of (reply_pk, <fields>...) tuples for the replies on
+    replylist, chunk_size at a time in primary key order.
+    """
+    if replies is None:
+        replies = replylist.replies.all()
+    replies = replies.filter(replylist=replylist).order_by('pk')
+
+    last_pk = None
+    while True:
+        chunk = replies
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk.values_list('pk', *fields)[:chunk_size])
+
+        if chunk:
+            yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+#-----------------------------------------------------------------------------
+# sending.
+
+def send_invitations(replylist, replies=None, workers=4, chunk_size=500,
+                     checkpoint=None, from_email=None, email_field='email',
+                     subject_template='please_reply/invitation_subject.txt',
+                     body_template='please_reply/invitation_email.txt',
+                     responses=('accept', 'decline'), slug_field='slug',
+                     salt=SECRET_SALT, base_url=None):
+    """
+    Email an invitation to every guest on replylist who hasn't responded, or
+    to the given replies, and return the number of emails sent. Guests
+    without an email address are skipped.
+
+    The templates are compiled once and rendered with the event, the guest's
+    email address and reply links, made absolute with base_url (by default
+    the domain of the current Site). Emails are sent by a pool of worker
+    threads that each keep one mail connection open.
+
+    If checkpoint is a file name, the pk of every reply that was emailed is
+    appended to it, and replies already listed there are skipped, so an
+    interrupted run can be started again without sending duplicates.
+    """
+    if replies is None:
+        replies = Reply.not_responded.all()
+
+    links = InvitationLinks(replylist, responses, slug_field, salt, base_url)
+    subject_template = get_template(subject_template)
+    body_template = get_template(body_template)
+    context = Context({'event': replylist.content_object,
+                       'replylist': replylist})
+
+    sent_before = read_checkpoint(checkpoint)
+    checkpoint_file = checkpoint and open(checkpoint, 'a')
+
+    # at most one chunk is queued at a time, the main loop waits for each.
+    messages = Queue.Queue()
+    results = Queue.Queue()
+    pool = [threading.Thread(target=_send_worker, args=(messages, results))
+            for i in range(workers)]
+    for worker in pool:
+        worker.daemon = True
+        worker.start()
+
+    state = {'sent': 0, 'errors': []}
+
+    def record(result):
+        """
+        note the result of one message, checkpointing it straight away.
+        """
+        reply_pk, error = result
+        if error is not None:
+            state['errors'].append((reply_pk, error))
+            return
+        state['sent'] += 1
+        if checkpoint_file:
+            checkpoint_file.write('%s\n' % reply_pk)
+            checkpoint_file.flush()
+
+    try:
+        for chunk in iter_reply_chunks(replylist, ('guest', 'guest__' +
+                                       email_field), replies, chunk_size):
+            queued = 0
+            for reply_pk, guest_pk, email in chunk:
+                if reply_pk in sent_before or not email:
+                    continue
+
+                form_url, response_urls = links.for_guest(guest_pk)
+                context.update({'email': email,
+                                'form_url': form_url,
+                                'response_urls': response_urls})
+                try:
+                    subject = ' '.join(
+                            subject_template.render(context).splitlines())
+                    body = body_template.render(context)
+                finally:
+                    context.pop()
+
+                messages.put((reply_pk,
+                    EmailMessage(subject, body, from_email, [email])))
+                queued += 1
+
+            # wait for the whole chunk so the checkpoint is complete.
+            while queued:
+                result = _next_result(results, pool, state['errors'])
+                if result[0] is not None:
+                    queued -= 1
+                record(result)
+            if checkpoint_file:
+                os.fsync(checkpoint_file.fileno())
+
+            if state['errors']:
+                raise state['errors'][0][1]
+    finally:
+        # drop the messages no worker has taken yet, and wait for the ones
+        # being sent so they are checkpointed too.
+        try:
+            while True:
+                messages.get_nowait()
+        except Queue.Empty:
+            pass
+        for worker in pool:
+            messages.put(None)
+        for worker in pool:
+            worker.join()
+        try:
+            while True:
+                record(results.get_nowait())
+        except Queue.Empty:
+            pass
+        if checkpoint_file:
+            os.fsync(checkpoint_file.fileno())
+            checkpoint_file.close()
+
+    return state['sent']
+
+def _next_result(results, pool, errors, poll=0.5):
+    """
+    Wait for the next (reply_pk, error) from the workers, raising the error
+    that stopped them if none are left to send.
+    """
+    while True:
+        try:
+            return results.get(timeout=poll)
+        except Queue.Empty:
+            if not any(worker.is_alive() for worker in pool):
+                if errors:
+                    raise errors[0][1]
+                raise RuntimeError("every invitation worker has stopped.")
+
+def read_checkpoint(checkpoint):
+    """
+    Return the set of reply pks listed in a checkpoint file.
+    """
+    if not checkpoint or not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as lines:
+        return set(int(line) for line in lines if line.strip())
+
+def _send_worker(messages, results):
+    """
+    Send (reply_pk, message) pairs from messages over one mail connection
+    until a None arrives, putting (reply_pk, error or None) on results.
+
+    If the connection can't be opened the worker puts (None, error) on
+    results and stops without taking any messages.
+    """
+    try:
+        connection = get_connection()
+        connection.open()
+    except Exception as error:
+        results.put((None, error))
+        return
+
+    try:
+        while True:
+            item = messages.get()
+            if item is None:
+                return
+            reply_pk, message = item
+            try:
+                message.connection = connection
+                message.send()
+            except Exception as error:
+                results.put((reply_pk, error))
+            else:
+                results.put((reply_pk, None))
+    finally:
+        connection.close()
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from please_reply.export import EXPORT_FORMATS
+from please_reply.models import ReplyList
+
+class Command(BaseCommand):
+    """
+    Stream the replies of a reply list to stdout as CSV or JSON lines.
+
+    """
+    args = "<reply_list_id>"
+    help = "Export the replies of a reply list."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+                    choices=sorted(EXPORT_FORMATS.keys()),
+                    help="csv (default) or jsonl."),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000,
+                    help="Number of replies read per query."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("usage: export_replies %s" % self.args)
+
+        try:
+            replylist = ReplyList.objects.get(pk=args[0])
+        except (ReplyList.DoesNotExist, ValueError):
+            raise CommandError("reply list %s does not exist" % args[0])
+
+        rows = EXPORT_FORMATS[options['format']][0]
+        for line in rows(replylist, chunk_size=options['chunk_size']):
+            self.stdout.write(line)
@@ -0,0 +1,38 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from please_reply.buffer import reply_buffer
+from please_reply.models import Reply
+
+class Command(NoArgsCommand):
+    """
+    Write the replies recorded in the reply buffer to the database.
+
+    """
+    help = "Write buffered replies to the replies table."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--interval', dest='interval', type='float', default=0,
+                    help="Keep flushing every INTERVAL seconds."),
+    )
+
+    def handle_noargs(self, **options):
+        if not reply_buffer.enabled:
+            raise CommandError("PLEASE_REPLY_REPLY_BUFFER is not set.")
+        if not reply_buffer.shared:
+            raise CommandError("PLEASE_REPLY_REPLY_BUFFER is 'local' or a "
+                               "locmem cache, its "
+                               "replies are in the memory of the process "
+                               "that took them and can only be flushed "
+                               "there, with "
+                               "Reply.objects.flush_buffered_replies().")
+
+        interval = options.get('interval')
+        while True:
+            flushed = Reply.objects.flush_buffered_replies()
+            self.stdout.write("%d buffered reply(s) written.\n" % flushed)
+            if not interval:
+                return
+            time.sleep(interval)
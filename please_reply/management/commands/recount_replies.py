@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from please_reply.models import ReplyList
+
+class Command(NoArgsCommand):
+    """
+    Recompute the denormalized reply counts on every ReplyList and report the
+    lists whose stored counts had drifted.
+
+    """
+    help = "Recompute the reply counts of every reply list."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help="Report drifted counts without correcting them."),
+    )
+
+    def handle_noargs(self, **options):
+        dry_run = options.get('dry_run')
+        drifted = ReplyList.objects.recount(fix=not dry_run)
+
+        for replylist_id, stored, actual in drifted:
+            self.stdout.write(
+                "reply list %s: invited/responded/attending %s/%s/%s, "
+                "should be %s/%s/%s\n" % ((replylist_id,) + stored + actual))
+
+        self.stdout.write("%d reply list(s) %s.\n" % (
+                len(drifted),
+                'have drifted' if dry_run else 'corrected'))
@@ -0,0 +1,51 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from please_reply.invitations import send_invitations
+from please_reply.models import ReplyList
+
+class Command(BaseCommand):
+    """
+    Email an invitation with reply links to every guest on a reply list who
+    hasn't responded yet.
+
+    """
+    args = "<reply_list_id>"
+    help = "Send invitation emails for a reply list."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=4,
+                    help="Number of threads sending email."),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=500,
+                    help="Number of replies read per query."),
+        make_option('--checkpoint', dest='checkpoint', default=None,
+                    help="File recording sent invitations, so that an "
+                         "interrupted run can be resumed."),
+        make_option('--from', dest='from_email', default=None,
+                    help="Sender address, DEFAULT_FROM_EMAIL if not given."),
+        make_option('--base-url', dest='base_url', default=None,
+                    help="Scheme and host the reply links start with, e.g. "
+                         "https://example.com, the current Site if not "
+                         "given."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("usage: send_invitations %s" % self.args)
+
+        try:
+            replylist = ReplyList.objects.get(pk=args[0])
+        except (ReplyList.DoesNotExist, ValueError):
+            raise CommandError("reply list %s does not exist" % args[0])
+
+        sent = send_invitations(
+                replylist,
+                workers=options['workers'],
+                chunk_size=options['chunk_size'],
+                checkpoint=options['checkpoint'],
+                from_email=options['from_email'],
+                base_url=options['base_url'])
+
+        self.stdout.write("%d invitation(s) sent.\n" % sent)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from django.db.models import Count, Min
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        """
+        Merge duplicate reply lists and replies so that the unique constraints
+        added in the next migration can be created.
+        """
+        ReplyList = orm['please_reply.ReplyList']
+        Reply = orm['please_reply.Reply']
+
+        # move replies on duplicate reply lists onto the oldest list.
+        duplicates = ReplyList.objects.values('content_type', 'object_id'
+                        ).annotate(count=Count('id'), keep=Min('id')
+                        ).filter(count__gt=1).order_by()
+
+        for duplicate in duplicates:
+            extras = ReplyList.objects.filter(
+                        content_type=duplicate['content_type'],
+                        object_id=duplicate['object_id']
+                     ).exclude(id=duplicate['keep'])
+
+            Reply.objects.filter(replylist__in=list(extras)
+                    ).update(replylist=duplicate['keep'])
+            extras.delete()
+
+        # keep one reply per guest, preferring the most recent response.
+        duplicates = Reply.objects.values('replylist', 'guest'
+                        ).annotate(count=Count('id')
+                        ).filter(count__gt=1).order_by()
+
+        for duplicate in duplicates:
+            replies = Reply.objects.filter(
+                        replylist=duplicate['replylist'],
+                        guest=duplicate['guest']
+                      ).order_by('-responded', '-modified_at', '-id')
+
+            Reply.objects.filter(
+                    id__in=[reply.id for reply in replies[1:]]).delete()
+
+    def backwards(self, orm):
+        "Merged duplicates are not split up again."
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'please_reply.reply': {
+            'Meta': {'ordering': "('replylist', '-responded', '-attending', 'guest')", 'object_name': 'Reply'},
+            'attending': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'guest': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'replylist': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'replies'", 'to': "orm['please_reply.ReplyList']"}),
+            'responded': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'please_reply.replylist': {
+            'Meta': {'ordering': "('content_type', '-object_id')", 'object_name': 'ReplyList'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'object_id': ('django.db.models.fields.CharField', [], {'max_length': '999'})
+        }
+    }
+
+    complete_apps = ['please_reply']
+    symmetrical = True
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # the object_id column is shortened below, check it fits first.
+        if not db.dry_run:
+            longest = db.execute('SELECT MAX(LENGTH(object_id)) '
+                                 'FROM please_reply_replylist')[0][0]
+            if longest > 255:
+                raise ValueError("ReplyList object_ids are up to %d "
+                                 "characters long, shorten or remove the ones "
+                                 "over 255 before migrating." % longest)
+
+        # Adding unique constraint on 'Reply', fields ['replylist', 'guest']
+        db.create_unique('please_reply_reply', ['replylist_id', 'guest_id'])
+
+        # MySQL can't index the 999 character object_id (utf8 keys are limited
+        # to 767 bytes), so it is shortened first. Databases migrated past
+        # here before this was added are shortened by migration 0010.
+        db.alter_column('please_reply_replylist', 'object_id',
+                        models.CharField(max_length=255))
+
+        # Adding unique constraint on 'ReplyList', fields ['object_id', 'content_type']
+        db.create_unique('please_reply_replylist', ['object_id', 'content_type_id'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'ReplyList', fields ['object_id', 'content_type']
+        db.delete_unique('please_reply_replylist', ['object_id', 'content_type_id'])
+        db.alter_column('please_reply_replylist', 'object_id',
+                        models.CharField(max_length=999))
+
+        # Removing unique constraint on 'Reply', fields ['replylist', 'guest']
+        db.delete_unique('please_reply_reply', ['replylist_id', 'guest_id'])
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'please_reply.reply': {
+            'Meta': {'ordering': "('replylist', '-responded', '-attending', 'guest')", 'unique_together': "(('replylist', 'guest'),)", 'object_name': 'Reply'},
+            'attending': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'guest': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'replylist': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'replies'", 'to': "orm['please_reply.ReplyList']"}),
+            'responded': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'please_reply.replylist': {
+            'Meta': {'ordering': "('content_type', '-object_id')", 'unique_together': "(('content_type', 'object_id'),)", 'object_name': 'ReplyList'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'object_id': ('django.db.models.fields.CharField', [], {'max_length': '999'})
+        }
+    }
+
+    complete_apps = ['please_reply']
\ No newline at end of file
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import datetime
+import uuid
+from south.db import db
+from south.v2 import SchemaMigration
+from django.conf import settings
+from django.db import models
+
+from please_reply import settings as backup_settings
+
+# ReplyList.object_id is only converted when PLEASE_REPLY_OBJECT_ID_TYPE is
+# 'integer' or 'uuid'; the frozen models below keep the char column.
+OBJECT_ID_TYPE = getattr(settings, 'PLEASE_REPLY_OBJECT_ID_TYPE',
+                         backup_settings.PLEASE_REPLY_OBJECT_ID_TYPE)
+
+TABLE = 'please_reply_replylist'
+
+def typed_field(null=False):
+    if OBJECT_ID_TYPE == 'integer':
+        return models.PositiveIntegerField(null=null)
+    return models.CharField(max_length=36, null=null)
+
+def typed_object_id(object_id):
+    """
+    the char object_id as it is stored in the typed column, uuids in their
+    canonical 36 character form.
+    """
+    try:
+        if OBJECT_ID_TYPE == 'integer':
+            return int(object_id)
+        return str(uuid.UUID(object_id))
+    except ValueError:
+        raise ValueError("ReplyList object_id %r isn't a valid %s, set "
+                         "PLEASE_REPLY_OBJECT_ID_TYPE to 'char' to keep it."
+                         % (object_id, OBJECT_ID_TYPE))
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        if OBJECT_ID_TYPE == 'char':
+            return
+
+        # Adding field 'ReplyList.typed_object_id'
+        db.add_column(TABLE, 'typed_object_id', typed_field(null=True),
+                      keep_default=False)
+
+        if not db.dry_run:
+            for pk, object_id in db.execute(
+                    'SELECT id, object_id FROM %s' % TABLE):
+                db.execute('UPDATE %s SET typed_object_id = %%s '
+                           'WHERE id = %%s' % TABLE,
+                           [typed_object_id(object_id), pk])
+
+        self.replace_object_id('typed_object_id', typed_field())
+
+    def backwards(self, orm):
+        if OBJECT_ID_TYPE == 'char':
+            return
+
+        # Adding field 'ReplyList.char_object_id'
+        db.add_column(TABLE, 'char_object_id',
+                      models.CharField(max_length=255, null=True),
+                      keep_default=False)
+
+        if not db.dry_run:
+            for pk, object_id in db.execute(
+                    'SELECT id, object_id FROM %s' % TABLE):
+                db.execute('UPDATE %s SET char_object_id = %%s '
+                           'WHERE id = %%s' % TABLE,
+                           [unicode(object_id), pk])
+
+        # 255 characters, the longest MySQL can index, see migration 0003.
+        self.replace_object_id('char_object_id',
+                               models.CharField(max_length=255))
+
+    def replace_object_id(self, column, field):
+        """
+        replace the object_id column with column, and make it unique per
+        content type again.
+        """
+        db.delete_unique(TABLE, ['object_id', 'content_type_id'])
+        db.delete_column(TABLE, 'object_id')
+        db.rename_column(TABLE, column, 'object_id')
+        db.alter_column(TABLE, 'object_id', field)
+        db.create_unique(TABLE, ['object_id', 'content_type_id'])
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'please_reply.reply': {
+            'Meta': {'ordering': "('replylist', '-responded', '-attending', 'guest')", 'unique_together': "(('replylist', 'guest'),)", 'object_name': 'Reply'},
+            'attending': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'guest': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'replylist': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'replies'", 'to': "orm['please_reply.ReplyList']"}),
+            'responded': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'please_reply.replylist': {
+            'Meta': {'ordering': "('content_type', '-object_id')", 'unique_together': "(('content_type', 'object_id'),)", 'object_name': 'ReplyList'},
+            'attending_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'event_identifier': ('django.db.models.fields.CharField', [], {'max_length': '999', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'invited_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'modified_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'object_id': ('django.db.models.fields.CharField', [], {'max_length': '999'}),
+            'responded_count': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['please_reply']
\ No newline at end of file
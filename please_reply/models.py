@@ -1,22 +1,41 @@
-import random
-import zlib
-import base64
+import uuid
+from datetime import datetime
 
-from django.db import models
-from django.db.models import get_model
+from django.db import (models, connections, router, transaction,
+                       IntegrityError)
+from django.db.models import get_model, signals, F, Count
 from django.conf import settings
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 
 from please_reply import settings as backup_settings
-from please_reply.exceptions import NotInvited, InvalidHash
+from please_reply.buffer import reply_buffer
+from please_reply.cache import (replylist_cache, replylist_saved,
+                                replylist_deleted, NO_REPLYLIST)
+from please_reply.codec import tinycode, encode_userhash, decode_userhash
+from please_reply.exceptions import NotInvited
+from please_reply.instrument import instrument_methods
+from please_reply.routers import primary_reads, is_stuck, stick_to_primary
+from please_reply.throttle import invalid_hashes, guest_invited
+from please_reply.userhash import make_userhash
 
 USER_MODEL = getattr(
                 settings,
                 'PLEASE_REPLY_USER_MODEL',
                 backup_settings.PLEASE_REPLY_USER_MODEL)
 
+OBJECT_ID_TYPE = getattr(
+                settings,
+                'PLEASE_REPLY_OBJECT_ID_TYPE',
+                backup_settings.PLEASE_REPLY_OBJECT_ID_TYPE)
+
+CHANGES_MAX_PAGE = getattr(
+                settings,
+                'PLEASE_REPLY_CHANGES_MAX_PAGE',
+                backup_settings.PLEASE_REPLY_CHANGES_MAX_PAGE)
+
 class ReplyListManager(models.Manager):
     """
     Defines helper functions to get all attendees for an event.
@@ -28,33 +47,247 @@ class ReplyListManager(models.Manager):
         Returns true if the guest is marked as attending this event.
 
         """
-        matching_guest = self.get_replylist_for(event
-            ).replies.filter(attending=True, guest=guest)
-        return any(matching_guest.all())
+        replylist_id = self.get_replylist_id_for(event)
+        guest_id = getattr(guest, 'pk', guest)
+
+        buffered = reply_buffer.pending(replylist_id, guest_id)
+        if buffered and 'attending' in buffered:
+            return buffered['attending']
+
+        # a guest who has just replied is read from the primary database.
+        with primary_reads(is_stuck(replylist_id, guest_id)):
+            return Reply.objects.filter(
+                    replylist=replylist_id,
+                    attending=True,
+                    guest=guest).exists()
+
+    def attending_map(self, event, guests=None, batch_size=500):
+        """
+        Return a dict of {guest_pk: (responded, attending)} for the given
+        guests of an event, or for every invited guest if guests is None.
 
-    def get_confirmed_guests_for(self, event):
+        guests may be a queryset, or an iterable of guests or guest primary
+        keys. Guests that weren't invited are left out.
         """
-        return all attending=True replies for the given event.
+        replylist_id = self.get_replylist_id_for(event)
+        replies = Reply.objects.filter(replylist=replylist_id).order_by()
+
+        if guests is None:
+            batches = [replies]
+        elif isinstance(guests, models.query.QuerySet):
+            batches = [replies.filter(guest__in=guests.values('pk'))]
+        else:
+            guest_ids = [getattr(guest, 'pk', guest) for guest in guests]
+            batches = [replies.filter(
+                            guest__in=guest_ids[start:start + batch_size])
+                       for start in range(0, len(guest_ids), batch_size)]
+
+        attending = {}
+        for batch in batches:
+            for guest_id, responded, is_attending in batch.values_list(
+                                    'guest', 'responded', 'attending'):
+                attending[guest_id] = (responded, is_attending)
+
+        # merge in replies that haven't been written yet.
+        buffered = reply_buffer.pending_many(replylist_id, attending.keys())
+        for guest_id, values in buffered.items():
+            responded, is_attending = attending[guest_id]
+            attending[guest_id] = (values.get('responded', responded),
+                                   values.get('attending', is_attending))
+        return attending
+
+    def get_confirmed_guests_for(self, event, ordering=None):
         """
-        return self.get_replylist_for(event
-                ).replies.filter(attending=True)
+        return all attending=True replies for the given event.
 
-    def get_invited_guests_for(self, event):
+        ordering replaces Reply.Meta.ordering, pass () to count or iterate the
+        replies without sorting them.
+        """
+        replies = Reply.objects.filter(
+                replylist=self.get_replylist_id_for(event),
+                attending=True)
+        if ordering is not None:
+            replies = replies.order_by(*ordering)
+        return replies
+
+    def get_invited_guests_for(self, event, ordering=None):
         """
         Return all Reply models for the given event.
+
+        ordering replaces Reply.Meta.ordering, pass () to count or iterate the
+        replies without sorting them.
+        """
+        replies = Reply.objects.filter(
+                replylist=self.get_replylist_id_for(event))
+        if ordering is not None:
+            replies = replies.order_by(*ordering)
+        return replies
+
+    def _object_id_for(self, event):
+        """
+        the pk of event as the object_id column stores it.
         """
-        return self.get_replylist_for(event
-               ).replies.all()
+        return self.model._meta.get_field('object_id').to_python(event.pk)
 
     def get_replylist_for(self, event):
         """
         Return the replylist for the given event.
+
+        Looked up by primary key when its id is cached, otherwise by the event
+        in one query, caching its id for next time.
         """
         event_type = ContentType.objects.get_for_model(event)
+        object_id = self._object_id_for(event)
+
+        replylist_id = replylist_cache.get(event_type.pk, object_id)
+        if replylist_id is None:
+            try:
+                replylist = self.get_query_set().get(
+                        object_id=object_id,
+                        content_type=event_type)
+            except self.model.DoesNotExist:
+                replylist_cache.set_missing(event_type.pk, object_id)
+                raise
+            replylist_cache.set(event_type.pk, object_id, replylist.pk)
+            return replylist
+
+        if replylist_id == NO_REPLYLIST:
+            raise self.model.DoesNotExist(
+                    "%s has no reply list" % (event,))
 
-        return self.get_query_set().get(
-                object_id=event.pk,
-                content_type=event_type)
+        try:
+            return self.get_query_set().get(pk=replylist_id)
+        except self.model.DoesNotExist:
+            # the cached id is stale, forget it.
+            replylist_cache.delete(event_type.pk, object_id)
+            raise
+
+    def get_replylist_id_for(self, event):
+        """
+        Return the id of the replylist for the given event, raises
+        ReplyList.DoesNotExist if the event has no replylist.
+
+        Uses the replylist cache when one is configured.
+        """
+        event_type = ContentType.objects.get_for_model(event)
+        object_id = self._object_id_for(event)
+
+        replylist_id = replylist_cache.get(event_type.pk, object_id)
+        if replylist_id is None:
+            try:
+                replylist_id = self.get_query_set().filter(
+                        object_id=object_id,
+                        content_type=event_type
+                    ).values_list('pk', flat=True).get()
+            except self.model.DoesNotExist:
+                replylist_cache.set_missing(event_type.pk, object_id)
+                raise
+            replylist_cache.set(event_type.pk, object_id, replylist_id)
+
+        if replylist_id == NO_REPLYLIST:
+            raise self.model.DoesNotExist(
+                    "%s has no reply list" % (event,))
+
+        return replylist_id
+
+    def get_replylists_for(self, events):
+        """
+        Return a dict mapping each of the given events to its replylist.
+
+        The events may be of different models, one query is made per model.
+        Events that have no replylist are left out.
+        """
+        replylists = {}
+        for event_type, events_by_id in _group_by_content_type(
+                                            events, self._object_id_for):
+            matching = self.get_query_set().filter(
+                    content_type=event_type,
+                    object_id__in=events_by_id.keys())
+
+            for replylist in matching:
+                event = events_by_id[unicode(replylist.object_id)]
+                # save the generic relation a second lookup of the event.
+                setattr(replylist, ReplyList.content_object.cache_attr, event)
+                replylists[event] = replylist
+
+        return replylists
+
+    def get_reply_counts_for(self, events):
+        """
+        Return a dict mapping each of the given events to a tuple of its
+        (invited, responded, attending) counts.
+
+        Reads the counts kept on each replylist, one query per event model.
+        Events that have no replylist are left out.
+        """
+        counts = {}
+        for event_type, events_by_id in _group_by_content_type(
+                                            events, self._object_id_for):
+            matching = self.get_query_set().filter(
+                    content_type=event_type,
+                    object_id__in=events_by_id.keys()
+                ).values_list('object_id', 'invited_count',
+                              'responded_count', 'attending_count')
+
+            for row in matching:
+                counts[events_by_id[unicode(row[0])]] = tuple(row[1:])
+
+        return counts
+
+    def adjust_counts(self, replylist_id, invited=0, responded=0, attending=0):
+        """
+        Atomically add the given deltas to the reply counts of a replylist.
+
+        modified_at is moved on with the counts, so it doubles as the time
+        of the latest change to the summary of the replylist.
+        """
+        deltas = (('invited_count', invited),
+                  ('responded_count', responded),
+                  ('attending_count', attending))
+
+        changes = dict((fieldname, F(fieldname) + delta)
+                       for fieldname, delta in deltas if delta)
+        if changes:
+            self.get_query_set().filter(pk=replylist_id).update(
+                    modified_at=datetime.now(), **changes)
+
+    def recount(self, fix=True):
+        """
+        Recompute the reply counts of every replylist from the replies table.
+
+        Returns a list of (replylist_id, stored_counts, actual_counts) for the
+        replylists whose stored counts had drifted, and corrects them unless
+        fix is False. Counts are given as (invited, responded, attending).
+        """
+        def counts_by_replylist(replies):
+            return dict(replies.values_list('replylist'
+                            ).annotate(count=Count('id')).order_by())
+
+        invited = counts_by_replylist(Reply.objects.all())
+        responded = counts_by_replylist(Reply.objects.filter(responded=True))
+        attending = counts_by_replylist(Reply.objects.filter(attending=True))
+
+        drifted = []
+        stored_counts = self.get_query_set().values_list(
+                'id', 'invited_count', 'responded_count', 'attending_count')
+
+        for row in stored_counts.iterator():
+            replylist_id, stored = row[0], tuple(row[1:])
+            actual = (invited.get(replylist_id, 0),
+                      responded.get(replylist_id, 0),
+                      attending.get(replylist_id, 0))
+
+            if stored == actual:
+                continue
+
+            drifted.append((replylist_id, stored, actual))
+            if fix:
+                self.get_query_set().filter(pk=replylist_id).update(
+                        invited_count=actual[0],
+                        responded_count=actual[1],
+                        attending_count=actual[2])
+
+        return drifted
 
     def create_replylist(self, event, guests=None):
         """
@@ -69,52 +302,218 @@ class ReplyListManager(models.Manager):
 
         content_type = ContentType.objects.get_for_model(event)
 
+        slug_field = tracked_event_identifiers.get(type(event))
+        identifier = {}
+        if slug_field:
+            identifier['event_identifier'] = getattr(event, slug_field)
+
+        # the unique constraint on (content_type, object_id) makes this safe
+        # against concurrent calls for the same event.
         replylist, created = self.model.objects.get_or_create(
-                    object_id=event.pk,
-                    content_type=content_type
+                    object_id=self._object_id_for(event),
+                    content_type=content_type,
+                    defaults=identifier
         )
 
-        replylist.save()
+        if not created:
+            # an update rather than a save, so the reply counts read above are
+            # never written back over replies counted since.
+            now = datetime.now()
+            self.get_query_set().filter(pk=replylist.pk).update(
+                    modified_at=now, **identifier)
+            replylist.modified_at = now
+            for fieldname, value in identifier.items():
+                setattr(replylist, fieldname, value)
 
         for guest in guests:
 
-            emptyreply, created = Reply.objects.get_or_create(
+            Reply.objects.get_or_create(
                     replylist=replylist,
                     guest=guest
             )
 
-            if created:
-                emptyreply.attending=False
-                emptyreply.responded=False
-                emptyreply.save()
-
         return replylist
 
+    def bulk_create_replylist(self, event, guests, batch_size=500):
+        """
+        Create a new reply list for a large guest-list.
+
+        guests may be a queryset of guests or an iterable of guest primary keys
+        (model instances are accepted too), so guest objects never have to be
+        loaded. The guests already on the list are fetched in one query and the
+        blank replies for the new guests are inserted batch_size at a time.
+
+        Returns a tuple of (replylist, existing_count, new_count).
+        """
+        replylist = self.create_replylist(event)
+
+        if isinstance(guests, models.query.QuerySet):
+            guests = guests.values_list('pk', flat=True).iterator()
+
+        # the replies are inserted into the write database, a replica may not
+        # have the guests that were just added yet.
+        db = router.db_for_write(Reply)
+        existing = set(replylist.replies.using(db).values_list('guest',
+                                                               flat=True))
+
+        existing_count = 0
+        new_count = 0
+        batch = []
+        seen = set()
+        for guest in guests:
+            guest_id = getattr(guest, 'pk', guest)
+            if guest_id in seen:
+                continue
+            seen.add(guest_id)
+
+            if guest_id in existing:
+                existing_count += 1
+                continue
+
+            batch.append(guest_id)
+            if len(batch) >= batch_size:
+                inserted = self._insert_blank_replies(replylist, batch)
+                existing_count += len(batch) - inserted
+                new_count += inserted
+                batch = []
+
+        if batch:
+            inserted = self._insert_blank_replies(replylist, batch)
+            existing_count += len(batch) - inserted
+            new_count += inserted
+
+        # bulk inserts don't send signals, so count the new guests here.
+        self.adjust_counts(replylist.pk, invited=new_count)
+        if new_count:
+            invalid_hashes.clear()
+
+        return replylist, existing_count, new_count
+
+    def _insert_blank_replies(self, replylist, guest_ids):
+        """
+        Insert blank replies for guest_ids and return how many were inserted.
+
+        If another process invited some of the same guests in the meantime the
+        unique constraint on (replylist, guest) rejects the batch, so only the
+        guests that are still missing are inserted again.
+        """
+        db = router.db_for_write(Reply)
+        sid = transaction.savepoint(using=db)
+        try:
+            bulk_insert(Reply, [Reply(replylist=replylist, guest_id=guest_id)
+                                for guest_id in guest_ids], using=db)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using=db)
+            existing = set(replylist.replies.using(db).filter(
+                                guest__in=guest_ids
+                                ).values_list('guest', flat=True))
+            guest_ids = [guest_id for guest_id in guest_ids
+                         if guest_id not in existing]
+            bulk_insert(Reply, [Reply(replylist=replylist, guest_id=guest_id)
+                                for guest_id in guest_ids], using=db)
+        else:
+            transaction.savepoint_commit(sid, using=db)
+
+        return len(guest_ids)
+
+class UUIDObjectIdField(models.CharField):
+    """
+    A uuid event pk kept as its 36 character text.
+
+    However the event gives its pk (without dashes, in upper case, in braces
+    or as a uuid.UUID), it is set, saved and looked up in the one form
+    migration 0009 converted the stored pks to.
+    """
+    __metaclass__ = models.SubfieldBase
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 36)
+        super(UUIDObjectIdField, self).__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value is None or value == '':
+            return value
+        try:
+            return unicode(uuid.UUID(unicode(value)))
+        except ValueError:
+            raise ValidationError("%r is not a uuid" % (value,))
+
+    def get_prep_value(self, value):
+        return self.to_python(value)
+
+try:
+    from south.modelsinspector import add_introspection_rules
+except ImportError:
+    pass
+else:
+    add_introspection_rules([], [r'^please_reply\.models\.UUIDObjectIdField'])
+
+def object_id_field(object_id_type=OBJECT_ID_TYPE):
+    """
+    The field for ReplyList.object_id, set by PLEASE_REPLY_OBJECT_ID_TYPE.
+
+    Integer and UUID pks are stored in a column that compares (and joins) with
+    the event table's pk, uuids as their 36 character text.
+    """
+    if object_id_type == 'integer':
+        return models.PositiveIntegerField()
+    if object_id_type == 'uuid':
+        return UUIDObjectIdField()
+    if object_id_type == 'char':
+        # the longest column MySQL can index in unique_together with utf8.
+        return models.CharField(max_length=255)
+    raise ValueError("PLEASE_REPLY_OBJECT_ID_TYPE must be 'char', 'integer' "
+                     "or 'uuid', not %r" % (object_id_type,))
+
 class ReplyList(models.Model):
     """
     A group of replies for an event.
     """
 
     # event instance.
-    object_id = models.CharField(max_length=999)
+    object_id = object_id_field()
     content_type = models.ForeignKey(ContentType)
     content_object = generic.GenericForeignKey('content_type', 'object_id')
 
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    # denormalized reply counts, kept up to date as replies change.
+    invited_count = models.IntegerField(default=0, editable=False)
+    responded_count = models.IntegerField(default=0, editable=False)
+    attending_count = models.IntegerField(default=0, editable=False)
+
+    # copy of the event's slug_field value, for event models registered with
+    # track_event_identifier, so reply links can be checked without the event.
+    event_identifier = models.CharField(max_length=999, null=True,
+                                        blank=True, editable=False)
+
     objects = ReplyListManager()
 
     class Meta:
         verbose_name = _("reply list")
         verbose_name_plural = _("reply lists")
         ordering = ("content_type", "-object_id")
+        unique_together = (("content_type", "object_id"),)
 
     def __unicode__(self):
         return u"replies for %s" % (
                     self.content_object
         )
 
+    def refresh_event_identifier(self, slug_field=None):
+        """
+        Copy the event's slug_field value into event_identifier, by default
+        from the field its event model is tracked with.
+        """
+        event = self.content_object
+        if slug_field is None:
+            slug_field = tracked_event_identifiers[type(event)]
+
+        self.event_identifier = getattr(event, slug_field)
+        ReplyList.objects.filter(pk=self.pk).update(
+                event_identifier=self.event_identifier)
+
 def make_simple_filter_manager(**filter_kwargs):
     """
     Factory function returns Manager class that filters
@@ -140,20 +539,253 @@ class ReplyManager(models.Manager):
         matching the event.
 
         """
-        replylist = ReplyList.objects.get_replylist_for(event)
+        replylist_id = ReplyList.objects.get_replylist_id_for(event)
         try:
             guest = self.model.objects.get(
-                        replylist=replylist,
+                        replylist=replylist_id,
                         guest=guest)
         except self.model.DoesNotExist:
             raise NotInvited("%s wasn't invited to %s" %
                                 (guest, event))
 
-        guest.attending = attending
-        guest.responded = True
-        guest.save()
+        self.update_reply(guest, attending=attending, responded=True)
         return guest
 
+    def update_reply(self, reply, **values):
+        """
+        Set the given fields of reply with one conditional UPDATE that leaves
+        the row (and modified_at) alone when it already has those values.
+
+        The UPDATE only matches the row while it still has the responded and
+        attending values reply was loaded with, so the replylist counts are
+        adjusted for the change that was actually written. If another request
+        changed the row first it is read again and the UPDATE retried. When
+        reply was loaded with the values already the row is only read.
+
+        Returns True if the row was changed.
+        """
+        db = router.db_for_write(self.model)
+        rows = self.get_query_set().using(db).filter(pk=reply.pk)
+
+        while True:
+            # the row as far as we know, the UPDATE checks it still is.
+            reply.responded, reply.attending = reply._counted_state
+            if all(getattr(reply, fieldname) == value and
+                   fieldname in ('responded', 'attending')
+                   for fieldname, value in values.items()):
+                # nothing to write unless the row changed, just read it.
+                changed = 0
+            else:
+                now = datetime.now()
+                changed = rows.filter(responded=reply.responded,
+                                      attending=reply.attending
+                            ).exclude(**values
+                            ).update(modified_at=now, **values)
+                if changed:
+                    break
+
+            try:
+                current = rows.values_list('responded', 'attending').get()
+            except self.model.DoesNotExist:
+                break
+            if current == reply._counted_state:
+                # the row already has the values.
+                break
+            reply._counted_state = current
+
+        for fieldname, value in values.items():
+            setattr(reply, fieldname, value)
+
+        # let the guest read their reply back before replicas catch up.
+        stick_to_primary(reply.replylist_id, reply.guest_id)
+
+        if changed:
+            reply.modified_at = now
+            # updates don't send signals, so adjust the counts here.
+            count_saved_reply(self.model, reply, created=False)
+        return bool(changed)
+
+    def reply_to_event_for_many(self, event, guests, attending,
+                                batch_size=500):
+        """
+        Set the reply of every guest in guests to attending (true or false)
+        for the replylist matching the event.
+
+        guests may be a queryset, or an iterable of guests or guest primary
+        keys. The replylist is looked up once and the replies are changed
+        with one UPDATE per batch_size guests.
+
+        Returns the list of given guests that weren't invited to the event,
+        rather than raising NotInvited.
+        """
+        replylist_id = ReplyList.objects.get_replylist_id_for(event)
+
+        if isinstance(guests, models.query.QuerySet):
+            guests = guests.values_list('pk', flat=True)
+        guests = list(guests)
+        guest_ids = [getattr(guest, 'pk', guest) for guest in guests]
+
+        invited = self.update_replies(replylist_id, guest_ids, batch_size,
+                                      attending=attending, responded=True)
+
+        return [guest for guest, guest_id in zip(guests, guest_ids)
+                if guest_id not in invited]
+
+    def flush_buffered_replies(self, batch_size=500):
+        """
+        Write the replies recorded in the reply buffer, one UPDATE per reply
+        list, reply and batch_size guests. Returns the number of replies.
+        """
+        replies = reply_buffer.drain()
+
+        guests_by_reply = {}
+        for replylist_id, guest_id, values in replies:
+            key = (replylist_id, tuple(sorted(values.items())))
+            guests_by_reply.setdefault(key, []).append(guest_id)
+
+        for (replylist_id, values), guest_ids in guests_by_reply.items():
+            self.update_replies(replylist_id, guest_ids, batch_size,
+                                **dict(values))
+
+        reply_buffer.done(replies)
+        return len(replies)
+
+    def keyset_page(self, replylist_id, after=None, limit=100):
+        """
+        Return a page of a replylist's replies ordered by (responded,
+        attending, id), and the cursor of the next page (None on the last).
+
+        after is the cursor returned with the previous page. Each of the four
+        (responded, attending) groups is read as a range of the index on
+        (replylist, responded, attending, id), so every page costs the same
+        however far into the list it is.
+        """
+        responded, attending, last_id = parse_keyset_cursor(after)
+
+        replies = []
+        for group in KEYSET_GROUPS:
+            if group < (responded, attending):
+                continue
+
+            page = self.get_query_set().select_related('guest').filter(
+                    replylist=replylist_id,
+                    responded=group[0],
+                    attending=group[1])
+            if group == (responded, attending) and last_id is not None:
+                page = page.filter(pk__gt=last_id)
+
+            # one reply more than asked for, to tell if there's a next page.
+            replies.extend(page.order_by('pk')[:limit + 1 - len(replies)])
+            if len(replies) > limit:
+                last = replies[limit - 1]
+                return replies[:limit], make_keyset_cursor(last)
+
+        return replies, None
+
+    def changes_since(self, after=None, replylist_id=None, limit=100):
+        """
+        Return the replies changed after the cursor after, oldest first, as
+        (replies, cursor, more).
+
+        cursor is the cursor to pass next time (after itself when nothing has
+        changed) and more is true when further changes are waiting. limit is
+        capped at PLEASE_REPLY_CHANGES_MAX_PAGE. With replylist_id only that
+        list's replies are returned.
+
+        Replies are ordered by (modified_at, id), using the index on
+        modified_at, or on (replylist, modified_at, id) for a single list. A
+        change committed with an older modified_at than one already read is
+        not seen, so feeds should stay a little behind busy writers.
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1, not %r' % limit)
+        limit = min(limit, CHANGES_MAX_PAGE)
+
+        changes = self.get_query_set()
+        if replylist_id is not None:
+            changes = changes.filter(replylist=replylist_id)
+
+        if after is not None:
+            modified_at, last_id = parse_changes_cursor(after)
+            changes = changes.filter(modified_at__gte=modified_at).exclude(
+                        modified_at=modified_at, pk__lte=last_id)
+
+        replies = list(changes.order_by('modified_at', 'pk')[:limit + 1])
+        more = len(replies) > limit
+        replies = replies[:limit]
+
+        if replies:
+            after = make_changes_cursor(replies[-1])
+        return replies, after, more
+
+    def update_replies(self, replylist_id, guest_ids, batch_size=500,
+                       **values):
+        """
+        Set the given fields on the replies of guest_ids on a replylist, with
+        one conditional UPDATE per batch_size guests that only touches the
+        rows not already in that state.
+
+        Returns the set of guest ids that have a reply on the replylist.
+        """
+        invited = set()
+        deltas = {'responded': 0, 'attending': 0}
+        now = datetime.now()
+        for start in range(0, len(guest_ids), batch_size):
+            replies = self.model.objects.filter(
+                        replylist=replylist_id,
+                        guest__in=guest_ids[start:start + batch_size])
+
+            for guest_id, responded, attending in replies.values_list(
+                                    'guest', 'responded', 'attending'):
+                invited.add(guest_id)
+                old = {'responded': responded, 'attending': attending}
+                for fieldname in deltas:
+                    if fieldname in values:
+                        deltas[fieldname] += (int(values[fieldname]) -
+                                              int(old[fieldname]))
+
+            replies.exclude(**values).update(modified_at=now, **values)
+
+        # updates don't send signals, so adjust the counts here.
+        ReplyList.objects.adjust_counts(replylist_id, **deltas)
+
+        return invited
+
+# keyset_page reads replies in these (responded, attending) groups.
+KEYSET_GROUPS = ((False, False), (False, True), (True, False), (True, True))
+
+def make_keyset_cursor(reply):
+    return '%d.%d.%d' % (reply.responded, reply.attending, reply.pk)
+
+def parse_keyset_cursor(cursor):
+    """
+    Return (responded, attending, id) from a keyset cursor, the start of the
+    list for None. Raises ValueError for a malformed cursor.
+    """
+    if cursor is None:
+        return False, False, None
+
+    responded, attending, last_id = [int(part)
+                                     for part in str(cursor).split('.')]
+    if responded not in (0, 1) or attending not in (0, 1):
+        raise ValueError('invalid keyset cursor %r' % cursor)
+    return bool(responded), bool(attending), last_id
+
+CHANGES_CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+def make_changes_cursor(reply):
+    return '%s_%d' % (reply.modified_at.strftime(CHANGES_CURSOR_FORMAT),
+                      reply.pk)
+
+def parse_changes_cursor(cursor):
+    """
+    Return (modified_at, id) from a changes cursor. Raises ValueError for a
+    malformed cursor.
+    """
+    modified_at, last_id = str(cursor).split('_')
+    return (datetime.strptime(modified_at, CHANGES_CURSOR_FORMAT),
+            int(last_id))
+
 class Reply(models.Model):
     """
     A single guest's reply to an event.
@@ -181,7 +813,7 @@ class Reply(models.Model):
     )
 
     created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     # custom managers.
     objects = ReplyManager()
@@ -190,14 +822,18 @@ class Reply(models.Model):
     
     def generate_userhash(self, salt):
         """
-        create XOR encrypted and base64 encoded text version of the guest__pk.
+        create the user hash of the guest__pk for reply links, in the format
+        set by PLEASE_REPLY_USERHASH_FORMAT.
         """
-        return encode_userhash(self.guest.pk, self.replylist.pk, salt)
+        return make_userhash(self.guest_id, self.replylist_id, salt)
 
     class Meta:
         verbose_name = _("reply")
         verbose_name_plural = _("replies")
         ordering = ("replylist", "-responded", "-attending", "guest")
+        unique_together = (("replylist", "guest"),)
+        # sql/reply.sql (or migration 0007) also indexes (replylist,
+        # responded, attending, id) for ReplyManager.keyset_page.
 
     def __unicode__(self):
         return u"%s is%s attending %s" % (
@@ -207,72 +843,166 @@ class Reply(models.Model):
         )
 
 #----------------------------------------------------------------------
-# Utilities
-def tinycode(key, text, reverse=False):
+# Reply counts
+def remember_reply_state(sender, instance, **kwargs):
     """
-    an XOR type encryption routine taken from 
-    http://code.activestate.com/recipes/266586-simple-xor-keyword-encryption/
-
-    This isn't a secure technique, I am only using it to slightly obscure an
-    otherwise obvious use of user.id in the uri. I know I could use a UUID for
-    this purpose, but I didn't want to add uuid as a dependancy for this
-    project.
+    Remember the state a reply was loaded with so that a later save knows
+    how to adjust the replylist counts.
+    """
+    instance._counted_state = (instance.responded, instance.attending)
 
+def count_saved_reply(sender, instance, created, raw=False, **kwargs):
     """
-    rand = random.Random(key).randrange
-    if not reverse:
-        text = zlib.compress(text)
-    text = ''.join([chr(ord(elem)^rand(256)) for elem in text])
-    if reverse:
-        text = zlib.decompress(text)
-    return text
+    Adjust the replylist counts for a new or changed reply.
+    """
+    if raw:
+        return
+
+    if created:
+        old_responded, old_attending, invited = False, False, 1
+    else:
+        (old_responded, old_attending), invited = instance._counted_state, 0
 
+    ReplyList.objects.adjust_counts(
+            instance.replylist_id,
+            invited=invited,
+            responded=int(instance.responded) - int(old_responded),
+            attending=int(instance.attending) - int(old_attending))
 
+    remember_reply_state(sender, instance)
 
-def decode_userhash(userhash, reply_list_id, salt):
+def count_deleted_reply(sender, instance, **kwargs):
     """
-    Decode and return the user-pk value.
-    Assume the unhashed text has the form:
+    Remove a deleted reply from the replylist counts.
+    """
+    responded, attending = instance._counted_state
+    ReplyList.objects.adjust_counts(
+            instance.replylist_id,
+            invited=-1,
+            responded=-int(responded),
+            attending=-int(attending))
 
-    userpk.
+signals.post_init.connect(remember_reply_state, sender=Reply)
+signals.post_save.connect(count_saved_reply, sender=Reply)
+signals.post_delete.connect(count_deleted_reply, sender=Reply)
+signals.post_save.connect(guest_invited, sender=Reply)
 
-    and was generated with key
+signals.post_save.connect(replylist_saved, sender=ReplyList)
+signals.post_delete.connect(replylist_deleted, sender=ReplyList)
 
-    salt%%reply_list_id
+#----------------------------------------------------------------------
+# Instrumentation
+
+instrument_methods(ReplyListManager, {
+    'is_guest_attending': None,
+    'attending_map': len,
+    'get_confirmed_guests_for': None,
+    'get_invited_guests_for': None,
+    'get_replylist_for': None,
+    'get_replylist_id_for': None,
+    'get_replylists_for': len,
+    'get_reply_counts_for': len,
+    'adjust_counts': None,
+    'recount': len,
+    'create_replylist': None,
+    'bulk_create_replylist': lambda result: result[2],
+})
+
+instrument_methods(ReplyManager, {
+    'reply_to_event_for': None,
+    'update_reply': int,
+    'reply_to_event_for_many': None,
+    'flush_buffered_replies': int,
+    'update_replies': len,
+    'keyset_page': lambda result: len(result[0]),
+    'changes_since': lambda result: len(result[0]),
+})
 
-    we are in big trouble if salt has %% in it!!.
-    so we assume they are not present.
-    """
+#----------------------------------------------------------------------
+# Event identifiers
 
-    reply_list_id = str(reply_list_id).replace("%%", "")
-    salt          = str(salt).replace("%%", "")
+# event model -> slug_field copied into ReplyList.event_identifier.
+tracked_event_identifiers = {}
 
-    key = "%%".join([salt, reply_list_id])
-    try:
-        userhash = base64.urlsafe_b64decode(str(userhash))
-    except TypeError:
-        raise InvalidHash('hash %s was not valid' % userhash)
-    try:
-        return tinycode(key, userhash, reverse=True)
-    except zlib.error:
-        raise InvalidHash('attempted to decrypt %s with invalid key %s' %
-                                (userhash, key))
-    
-def encode_userhash(userpk, reply_list_id, salt):
+def track_event_identifier(event_model, slug_field='slug'):
     """
-    Return a base64 XOR encrypted text using a key of:
+    Keep a copy of event_model's slug_field on its reply lists.
 
-    salt%%reply_list_id
+    validate_please_reply_uri then checks the slug of links to these events
+    against the copy instead of querying the event table. Call this once, for
+    example from the models module of the app defining event_model, and
+    refresh reply lists that already exist with refresh_event_identifier.
+    """
+    tracked_event_identifiers[event_model] = slug_field
+    signals.post_save.connect(event_saved, sender=event_model,
+                              dispatch_uid='please_reply.event_identifier')
 
-    where any '%%' has been removed from salt and reply_list_id
+def event_saved(sender, instance, raw=False, **kwargs):
+    """
+    Update the copied identifier on the event's reply list.
     """
+    slug_field = tracked_event_identifiers.get(sender)
+    if raw or not slug_field:
+        return
 
-    reply_list_id = unicode(reply_list_id).replace("%%", "")
-    salt          = unicode(salt).replace("%%", "")
+    identifier = getattr(instance, slug_field)
+    ReplyList.objects.filter(
+            content_type=ContentType.objects.get_for_model(instance),
+            object_id=instance.pk
+        ).exclude(event_identifier=identifier
+        ).update(event_identifier=identifier)
 
-    key = "%%".join([salt, reply_list_id])
+#----------------------------------------------------------------------
+# Utilities
+def _group_by_content_type(events, object_id_for):
+    """
+    Group events by their content type.
 
-    userhash = tinycode(key, str(userpk))
-    return base64.urlsafe_b64encode(userhash)
+    Returns a list of (content_type, {object_id: event}) pairs, where
+    object_id is the event pk as object_id_for(event) says it is stored on
+    the ReplyList.
+    """
+    grouped = {}
+    for event in events:
+        event_type = ContentType.objects.get_for_model(event)
+        grouped.setdefault(event_type, {})[
+                unicode(object_id_for(event))] = event
+    return grouped.items()
 
+def bulk_insert(model, objs, using=None):
+    """
+    Insert the unsaved model instances in objs using a single statement, into
+    the database using, by default the one the routers write model to.
 
+    Uses the manager's bulk_create where Django provides it, otherwise builds
+    one INSERT and hands all rows to the cursor's executemany. Neither path
+    sends signals or calls save() on the instances.
+    """
+    if not objs:
+        return
+
+    if using is None:
+        using = router.db_for_write(model)
+    connection = connections[using]
+
+    manager = model._default_manager.db_manager(using)
+    if hasattr(manager, 'bulk_create'):
+        manager.bulk_create(objs)
+        return
+
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields
+              if not isinstance(f, models.AutoField)]
+
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            qn(model._meta.db_table),
+            ", ".join(qn(f.column) for f in fields),
+            ", ".join(["%s"] * len(fields)))
+
+    rows = [[f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+             for f in fields]
+            for obj in objs]
+
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    transaction.commit_unless_managed(using=using)
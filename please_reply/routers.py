@@ -0,0 +1,137 @@
+"""
+A database router that reads replies and reply lists from replicas and
+writes them to the primary database.
+
+    DATABASE_ROUTERS = ['please_reply.routers.ReplicaRouter']
+
+    PLEASE_REPLY_PRIMARY_DATABASE = 'default'
+    PLEASE_REPLY_REPLICA_DATABASES = ('replica1', 'replica2')
+
+A guest who has just replied could be shown their old reply by a replica
+that hasn't caught up yet. So after a reply the (replylist, guest) pair is
+remembered for PLEASE_REPLY_STICKY_SECONDS in the cache named by
+PLEASE_REPLY_STICKY_CACHE, and while it is, the reads for that guest's reply
+links and is_guest_attending go to the primary.
+
+With no replicas configured the router leaves routing to Django.
+
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from please_reply import settings as backup_settings
+
+#-----------------------------------------------------------------------------
+# settings.
+
+PRIMARY_DATABASE = getattr(
+                settings,
+               'PLEASE_REPLY_PRIMARY_DATABASE',
+                backup_settings.PLEASE_REPLY_PRIMARY_DATABASE)
+
+REPLICA_DATABASES = tuple(getattr(
+                settings,
+               'PLEASE_REPLY_REPLICA_DATABASES',
+                backup_settings.PLEASE_REPLY_REPLICA_DATABASES))
+
+STICKY_SECONDS = getattr(
+                settings,
+               'PLEASE_REPLY_STICKY_SECONDS',
+                backup_settings.PLEASE_REPLY_STICKY_SECONDS)
+
+STICKY_CACHE = getattr(
+                settings,
+               'PLEASE_REPLY_STICKY_CACHE',
+                backup_settings.PLEASE_REPLY_STICKY_CACHE)
+
+#-----------------------------------------------------------------------------
+# read your writes.
+
+_state = threading.local()
+
+def sticky_key(replylist_id, guest_id):
+    return 'please_reply.sticky.%s.%s' % (replylist_id, guest_id)
+
+def stick_to_primary(replylist_id, guest_id):
+    """
+    send reads for the guest's reply to the primary for STICKY_SECONDS, and
+    for the rest of the current primary_reads block.
+    """
+    if not REPLICA_DATABASES:
+        return
+
+    get_cache(STICKY_CACHE).set(sticky_key(replylist_id, guest_id), True,
+                                STICKY_SECONDS)
+    if getattr(_state, 'depth', 0):
+        _state.primary = True
+
+def is_stuck(replylist_id, guest_id):
+    if not REPLICA_DATABASES:
+        return False
+    return bool(get_cache(STICKY_CACHE).get(
+                    sticky_key(replylist_id, guest_id)))
+
+class primary_reads(object):
+    """
+    A block in which please_reply reads go to the primary if enabled, or
+    once the guest being read has recently replied.
+
+        with primary_reads(is_stuck(replylist_id, guest_id)):
+            ...
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+    def __enter__(self):
+        self.old_primary = getattr(_state, 'primary', False)
+        _state.depth = getattr(_state, 'depth', 0) + 1
+        _state.primary = self.old_primary or self.enabled
+        return self
+
+    def __exit__(self, *exc_info):
+        _state.depth -= 1
+        _state.primary = self.old_primary
+
+def follow_stickiness(replylist_id, guest_id):
+    """
+    inside a primary_reads block, read from the primary from now on if the
+    guest has recently replied.
+    """
+    if getattr(_state, 'depth', 0) and is_stuck(replylist_id, guest_id):
+        _state.primary = True
+
+#-----------------------------------------------------------------------------
+# router.
+
+class ReplicaRouter(object):
+    """
+    Routes please_reply reads to a random replica, or the primary inside a
+    sticky primary_reads block, and please_reply writes to the primary.
+    """
+    app_label = 'please_reply'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label or not REPLICA_DATABASES:
+            return None
+        if getattr(_state, 'primary', False):
+            return PRIMARY_DATABASE
+        return random.choice(REPLICA_DATABASES)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label or not REPLICA_DATABASES:
+            return None
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold copies of the primary, so objects read from any of
+        # them may be related.
+        databases = (PRIMARY_DATABASE,) + REPLICA_DATABASES
+        if (self.app_label in (obj1._meta.app_label, obj2._meta.app_label)
+                and obj1._state.db in databases
+                and obj2._state.db in databases):
+            return True
+        return None
@@ -6,3 +6,85 @@ PLEASE_REPLY_VIEW_RESPONSE_HANDLERS = {
         'accept': 'please_reply.views.generic_acceptance',
         'decline':'please_reply.views.generic_rejectance',
 }
+
+# name of the cache (from CACHES) used to look up an event's reply list,
+# None disables the cache.
+PLEASE_REPLY_REPLYLIST_CACHE = None
+
+PLEASE_REPLY_REPLYLIST_CACHE_TIMEOUT = 60 * 60
+
+# how long to remember that an event has no reply list.
+PLEASE_REPLY_REPLYLIST_NEGATIVE_CACHE_TIMEOUT = 60
+
+# format of the user hash in new reply links: 'legacy' for the XOR encoded
+# hash, or 'signed' for an HMAC signed token that also carries the reply list.
+PLEASE_REPLY_USERHASH_FORMAT = 'legacy'
+
+# keep accepting legacy user hashes, turn off once old links have expired.
+PLEASE_REPLY_ACCEPT_LEGACY_USERHASH = True
+
+# seconds a signed user hash stays valid for, None for no expiry.
+PLEASE_REPLY_SIGNED_USERHASH_MAX_AGE = None
+
+# reply fields (and guest__ fields) written when exporting a reply list.
+PLEASE_REPLY_EXPORT_FIELDS = (
+        'guest__username',
+        'guest__first_name',
+        'guest__last_name',
+        'guest__email',
+        'responded',
+        'attending',
+        'modified_at',
+)
+
+# buffer replies from the generic handlers instead of writing each one:
+# None, 'local' for this process only, or the name of a cache from CACHES.
+PLEASE_REPLY_REPLY_BUFFER = None
+
+PLEASE_REPLY_REPLY_BUFFER_TIMEOUT = 24 * 60 * 60
+
+# remember this many reply links that failed validation (per process) so
+# that they're turned away without decoding them again, 0 disables it.
+PLEASE_REPLY_INVALID_HASH_CACHE_SIZE = 10000
+
+PLEASE_REPLY_INVALID_HASH_TIMEOUT = 5 * 60
+
+# name of the cache (from CACHES) holding a token bucket per client ip that
+# failed reply links drain, None disables the throttle.
+PLEASE_REPLY_THROTTLE_CACHE = None
+
+# failed links allowed in a burst, and tokens given back per second.
+PLEASE_REPLY_THROTTLE_BURST = 20
+
+PLEASE_REPLY_THROTTLE_RATE = 0.5
+
+# request.META key of the header holding the client ip when the site is behind
+# a proxy, e.g. 'HTTP_X_FORWARDED_FOR'. None throttles by REMOTE_ADDR.
+PLEASE_REPLY_THROTTLE_IP_HEADER = None
+
+# where to send measurements of manager methods and reply views: None (off),
+# 'signal', 'logging', 'stats' or the dotted path of a sink class.
+PLEASE_REPLY_INSTRUMENTATION = None
+
+# call times kept per name by the 'stats' sink for its percentiles.
+PLEASE_REPLY_INSTRUMENTATION_SAMPLES = 1000
+
+# the most replies returned by one page of the change feed.
+PLEASE_REPLY_CHANGES_MAX_PAGE = 1000
+
+# databases used by please_reply.routers.ReplicaRouter: writes go to the
+# primary and reads to one of the replicas, none turns the router off.
+PLEASE_REPLY_PRIMARY_DATABASE = 'default'
+
+PLEASE_REPLY_REPLICA_DATABASES = ()
+
+# how long a guest's reads stay on the primary after they reply, and the
+# name of the cache (from CACHES) that remembers it.
+PLEASE_REPLY_STICKY_SECONDS = 10
+
+PLEASE_REPLY_STICKY_CACHE = 'default'
+
+# column type of ReplyList.object_id: 'char' for any event pk up to 255
+# characters, or 'integer' or 'uuid' to match the pks of your event models.
+# migration 0009 converts the column when this is changed before migrating.
+PLEASE_REPLY_OBJECT_ID_TYPE = 'char'
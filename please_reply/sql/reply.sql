@@ -0,0 +1,11 @@
+-- Indexes syncdb can't express in Django 1.3, run by syncdb after it creates
+-- please_reply_reply. Projects using South get them from the migrations
+-- instead, under the same names.
+
+-- ReplyManager.keyset_page, migration 0007.
+CREATE INDEX please_reply_reply_replylist_id_d8e7bef4f4636d9
+    ON please_reply_reply (replylist_id, responded, attending, id);
+
+-- ReplyManager.changes_since for one reply list, migration 0008.
+CREATE INDEX please_reply_reply_replylist_id_a3efb46a27b635c
+    ON please_reply_reply (replylist_id, modified_at, id);
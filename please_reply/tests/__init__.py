@@ -1,2 +1,4 @@
 from model_tests import *
 from views_tests import *
+from codec_tests import *
+from benchmarks_tests import *
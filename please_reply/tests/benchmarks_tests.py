@@ -0,0 +1,59 @@
+from django.test import TestCase
+from django.utils import simplejson
+
+from please_reply.benchmarks import hotpaths
+
+def result(name, guests, ms_per_op, queries_per_op):
+    return dict(name=name, guests=guests, ms_per_op=ms_per_op,
+                queries_per_op=queries_per_op)
+
+class HotPathsBenchmarkTest(TestCase):
+    """
+    Test the hot path benchmarks run and spot regressions.
+
+    """
+
+    def test_run_small_guest_list(self):
+        results = hotpaths.run(sizes=[10], samples=3)['results']
+
+        self.assertEqual(
+                ['create_replylist', 'bulk_create_replylist',
+                 'encode_userhash', 'decode_userhash',
+                 'reply_to_event_for', 'is_guest_attending',
+                 'please_reply_reply_form', 'please_reply_replied'],
+                [r['name'] for r in results])
+        self.assertEqual([0, 0], [r['queries'] for r in results
+                                  if r['name'].endswith('_userhash')])
+        self.assertTrue(all(r['queries'] for r in results
+                            if r['name'].startswith('please_reply_')))
+
+    def test_compare_with_baseline(self):
+        baseline = {'results': [result('decode_userhash', 10, 1.0, 0),
+                                result('reply_to_event_for', 10, 1.0, 2),
+                                result('is_guest_attending', 10, 1.0, 2)]}
+        results = {'results': [result('decode_userhash', 10, 1.2, 0),
+                               result('reply_to_event_for', 10, 1.0, 3),
+                               result('is_guest_attending', 10, 2.0, 2),
+                               result('is_guest_attending', 1000, 9.0, 9)]}
+
+        regressions = hotpaths.compare(results, baseline, tolerance=0.25)
+        self.assertEqual(2, len(regressions))
+        self.assertTrue(regressions[0].startswith('reply_to_event_for'))
+        self.assertTrue(regressions[1].startswith('is_guest_attending'))
+
+        # without a tolerance only the query counts are compared.
+        regressions = hotpaths.compare(results, baseline, tolerance=None)
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith('reply_to_event_for'))
+
+    def test_baseline_covers_every_path_and_size(self):
+        baseline = simplejson.load(open(hotpaths.BASELINE))
+        names = ['create_replylist', 'bulk_create_replylist',
+                 'encode_userhash', 'decode_userhash',
+                 'reply_to_event_for', 'is_guest_attending',
+                 'please_reply_reply_form', 'please_reply_replied']
+
+        self.assertEqual(
+                sorted((name, size) for name in names
+                       for size in hotpaths.SIZES),
+                sorted((r['name'], r['guests']) for r in baseline['results']))
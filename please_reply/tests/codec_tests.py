@@ -0,0 +1,70 @@
+from django.test import TestCase
+
+from please_reply import codec
+from please_reply.benchmarks.codec import (legacy_encode_userhash,
+                                           legacy_decode_userhash)
+from please_reply.exceptions import InvalidHash
+
+SALT = 's3cR3t547T'
+
+class UserHashCodecTest(TestCase):
+    """
+    Test that the user hash codec is compatible with existing links.
+
+    """
+
+    def test_encode_matches_legacy_codec(self):
+        for reply_list_id in (1, 12, 'abc'):
+            for userpk in (1, 42, 123456789, 10 ** 40):
+                self.assertEqual(
+                    legacy_encode_userhash(userpk, reply_list_id, SALT),
+                    codec.encode_userhash(userpk, reply_list_id, SALT))
+
+    def test_decode_legacy_hashes(self):
+        for userpk in (10 ** 40, 1, 42):
+            userhash = legacy_encode_userhash(userpk, 7, SALT)
+            self.assertEqual(str(userpk),
+                             codec.decode_userhash(userhash, 7, SALT))
+            self.assertEqual(str(userpk),
+                             legacy_decode_userhash(userhash, 7, SALT))
+
+    def test_keystream_cache_is_bounded(self):
+        old_size = codec.KEYSTREAM_CACHE_SIZE
+        codec.KEYSTREAM_CACHE_SIZE = 2
+        try:
+            for reply_list_id in range(10):
+                codec.encode_userhash(1, reply_list_id, SALT)
+            self.assertTrue(len(codec._keystreams) <= 2)
+            self.assertTrue(len(codec._old_keystreams) <= 2)
+        finally:
+            codec.KEYSTREAM_CACHE_SIZE = old_size
+
+    def test_invalid_hash(self):
+        userhash = codec.encode_userhash(1, 7, SALT)
+        self.assertRaises(InvalidHash,
+                          codec.decode_userhash, userhash, 8, SALT)
+
+class SignedTokenTest(TestCase):
+    """
+    Test signed tokens carrying the reply list and guest.
+
+    """
+
+    def test_token_round_trip(self):
+        token = codec.encode_token(1234, 56, 'secret')
+        self.assertEqual((56, 1234), codec.decode_token(token, 'secret'))
+
+    def test_forged_or_malformed_token(self):
+        token = codec.encode_token(1234, 56, 'secret')
+        forged = token.replace('_ya_', '_yb_')
+
+        for bad in (forged, token + '0', token[:-1], 'garbage', '1_2_3',
+                    u'1_\xe9_2_3', codec.encode_token(1234, 56, 'other')):
+            self.assertRaises(InvalidHash, codec.decode_token, bad, 'secret')
+
+    def test_expired_token(self):
+        token = codec.encode_token(1, 2, 'secret', expires=1000)
+
+        self.assertEqual((2, 1), codec.decode_token(token, 'secret', now=999))
+        self.assertRaises(InvalidHash,
+                          codec.decode_token, token, 'secret', now=1001)
@@ -1,12 +1,20 @@
+import uuid
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.test import TestCase
 from django.test.client import Client
+from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import get_cache
+from django.core.exceptions import ValidationError
+from django.db import models, IntegrityError, connection
+from django.utils.unittest import skipUnless
 
 from please_reply import exceptions
-from please_reply.tests.models import Event
-from please_reply.models import ReplyList, Reply
+from please_reply.cache import replylist_cache
+from please_reply.tests.models import Event, UUIDEvent, UUIDReplyList
+from please_reply.models import ReplyList, Reply, object_id_field
 
 #--------------------------------------------------------------
 # helper functions
@@ -108,6 +116,39 @@ class ReplyManagementTest(RelateEventsToGuests):
                        event('jenga')))
         )
 
+    def test_reply_manager_reply_to_event_for_many(self):
+        """
+        Manager should mark many guests at once and report the guests that
+        weren't invited.
+        """
+        jenga = event('jenga')
+
+        not_invited = Reply.objects.reply_to_event_for_many(
+            jenga,
+            [user('sally'), user('jill'), user('sven')],
+            attending=True,
+        )
+
+        self.assertEqual([user('jill')], not_invited)
+        self.assertEqual(
+                sortname([user('sally'), user('sven')]),
+                sortname(guests(ReplyList.objects.get_confirmed_guests_for(
+                       jenga)))
+        )
+
+        not_invited = Reply.objects.reply_to_event_for_many(
+            jenga,
+            User.objects.filter(username='sven'),
+            attending=False,
+        )
+
+        self.assertEqual([], not_invited)
+        self.assertEqual(
+                [user('sally')],
+                guests(ReplyList.objects.get_confirmed_guests_for(jenga))
+        )
+        self.assertEqual(Reply.not_responded.count(), 2)
+
 class ReplyListManagementTest(RelateEventsToGuests):
     """
     Test the management methods on the replylist.
@@ -142,6 +183,36 @@ class ReplyListManagementTest(RelateEventsToGuests):
                 guests(get_confirmed_guests_for(jenga))
         )
 
+    def test_replylist_manager_is_guest_attending(self):
+        jenga = event('jenga')
+        Reply.objects.reply_to_event_for(jenga, user('sven'), True)
+
+        self.assertTrue(
+                ReplyList.objects.is_guest_attending(jenga, user('sven')))
+        self.assertFalse(
+                ReplyList.objects.is_guest_attending(jenga, user('sally')))
+        self.assertFalse(
+                ReplyList.objects.is_guest_attending(jenga, user('jill')))
+
+    def test_replylist_manager_attending_map(self):
+        """
+        Manager should return the reply state of many guests in one query.
+        """
+        jenga = event('jenga')
+        Reply.objects.reply_to_event_for(jenga, user('sven'), True)
+        expected = {user('sven').pk: (True, True),
+                    user('sally').pk: (False, False)}
+        guest_list = [user('sven'), user('sally').pk, user('jill')]
+
+        # one query for the replylist and one for the replies.
+        with self.assertNumQueries(2):
+            attending = ReplyList.objects.attending_map(jenga, guest_list)
+        self.assertEqual(expected, attending)
+
+        self.assertEqual(expected, ReplyList.objects.attending_map(jenga))
+        self.assertEqual(expected, ReplyList.objects.attending_map(
+                jenga, User.objects.all()))
+
     def test_replylist_manager_guests(self):
         """
         Manager should return all invited guests for an event.
@@ -186,3 +257,415 @@ class ReplyListManagementTest(RelateEventsToGuests):
 
 
 
+class BulkReplyListTest(RelateEventsToGuests):
+    """
+    Test creating large reply lists without per-guest queries.
+
+    """
+
+    def test_bulk_create_replylist_adds_new_guests(self):
+        """
+        Existing guests are counted and left alone, new guests get blank
+        replies.
+        """
+        jenga = event('jenga')
+        Reply.objects.reply_to_event_for(jenga, user('sven'), attending=True)
+
+        guest_ids = [user(name).pk for name in ('sven', 'sally', 'gertrude')]
+
+        replylist, existing, new = ReplyList.objects.bulk_create_replylist(
+                jenga, guest_ids)
+
+        self.assertEqual((existing, new), (2, 1))
+        self.assertEqual(
+                [user('sven')],
+                guests(ReplyList.objects.get_confirmed_guests_for(jenga))
+        )
+        self.assertEqual(
+                sortname([user('sally'), user('gertrude'), user('sven')]),
+                sortname(guests(ReplyList.objects.get_invited_guests_for(jenga)))
+        )
+
+    def test_bulk_create_replylist_accepts_queryset(self):
+        """
+        A queryset of guests may be given, duplicates are only added once.
+        """
+        bbq = event('bbq')
+
+        replylist, existing, new = ReplyList.objects.bulk_create_replylist(
+                bbq, User.objects.all(), batch_size=2)
+
+        self.assertEqual((existing, new), (1, 4))
+        self.assertEqual(replylist.replies.count(), 5)
+        self.assertEqual(replylist.replies.filter(responded=True).count(), 0)
+
+        replylist, existing, new = ReplyList.objects.bulk_create_replylist(
+                bbq, User.objects.all())
+        self.assertEqual((existing, new), (5, 0))
+
+    def test_bulk_insert_skips_guests_added_concurrently(self):
+        """
+        Guests invited by another process between the existing-guest check and
+        the insert are skipped rather than breaking the whole batch.
+        """
+        replylist = ReplyList.objects.get_replylist_for(event('bbq'))
+
+        inserted = ReplyList.objects._insert_blank_replies(
+                replylist, [user('sally').pk, user('jill').pk])
+
+        self.assertEqual(inserted, 1)
+        self.assertEqual(
+                sortname([user('sally'), user('jill')]),
+                sortname(guests(replylist.replies.all()))
+        )
+
+class UniqueReplyListTest(RelateEventsToGuests):
+    """
+    Test that an event has one reply list and a guest one reply per list.
+
+    """
+
+    def test_create_replylist_twice_returns_same_list(self):
+        jenga = event('jenga')
+        replylist = ReplyList.objects.create_replylist(jenga)
+
+        self.assertEqual(replylist, ReplyList.objects.get_replylist_for(jenga))
+        self.assertEqual(
+                ReplyList.objects.filter(object_id=jenga.pk).count(), 1)
+
+    def test_replylist_is_read_in_one_query_without_cache(self):
+        jenga = event('jenga')
+        ContentType.objects.get_for_model(jenga)
+
+        with self.assertNumQueries(1):
+            replylist = ReplyList.objects.get_replylist_for(jenga)
+        self.assertEqual(jenga, replylist.content_object)
+
+    def test_duplicate_reply_is_rejected(self):
+        replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+
+        self.assertRaises(IntegrityError,
+                          Reply.objects.create,
+                            replylist=replylist,
+                            guest=user('sven')
+        )
+
+class ReplyCountsTest(RelateEventsToGuests):
+    """
+    Test the denormalized reply counts on the replylist.
+
+    """
+
+    def counts(self, title):
+        replylist = ReplyList.objects.get_replylist_for(event(title))
+        return (replylist.invited_count,
+                replylist.responded_count,
+                replylist.attending_count)
+
+    def test_counts_follow_replies(self):
+        self.assertEqual(self.counts('jenga'), (2, 0, 0))
+
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+        self.assertEqual(self.counts('jenga'), (2, 1, 1))
+
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), False)
+        self.assertEqual(self.counts('jenga'), (2, 1, 0))
+
+        Reply.objects.get(guest=user('sven')).delete()
+        self.assertEqual(self.counts('jenga'), (1, 0, 0))
+
+    def test_counts_follow_concurrent_updates(self):
+        """
+        Two requests that loaded the same reply both update it, the second
+        one is counted against the row the first left behind.
+        """
+        first = Reply.objects.get(guest=user('sven'))
+        second = Reply.objects.get(guest=user('sven'))
+
+        self.assertTrue(Reply.objects.update_reply(second, responded=True))
+        self.assertTrue(Reply.objects.update_reply(first, responded=True,
+                                                   attending=True))
+        self.assertEqual(self.counts('jenga'), (2, 1, 1))
+
+        self.assertFalse(Reply.objects.update_reply(second, responded=True))
+        self.assertEqual((second.responded, second.attending), (True, True))
+        self.assertEqual(self.counts('jenga'), (2, 1, 1))
+
+    def test_counts_follow_bulk_changes(self):
+        ReplyList.objects.bulk_create_replylist(event('jenga'),
+                                                User.objects.all())
+        self.assertEqual(self.counts('jenga'), (5, 0, 0))
+
+        Reply.objects.reply_to_event_for_many(event('jenga'),
+                User.objects.all(), attending=True)
+        self.assertEqual(self.counts('jenga'), (5, 5, 5))
+
+        Reply.objects.reply_to_event_for_many(event('jenga'),
+                [user('sven'), user('jim')], attending=False)
+        self.assertEqual(self.counts('jenga'), (5, 5, 3))
+
+    def test_recreating_replylist_keeps_counts(self):
+        """
+        Replies counted while create_replylist runs again for the event are
+        not overwritten by the counts it read.
+        """
+        jenga = event('jenga')
+        get_or_create = ReplyList.objects.get_or_create
+
+        def get_or_create_then_reply(**kwargs):
+            result = get_or_create(**kwargs)
+            Reply.objects.reply_to_event_for(jenga, user('sven'), True)
+            return result
+
+        ReplyList.objects.get_or_create = get_or_create_then_reply
+        try:
+            ReplyList.objects.create_replylist(jenga)
+        finally:
+            del ReplyList.objects.get_or_create
+
+        self.assertEqual(self.counts('jenga'), (2, 1, 1))
+
+    def test_recount_corrects_drift(self):
+        replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+        ReplyList.objects.filter(pk=replylist.pk).update(invited_count=7)
+
+        self.assertEqual(
+                [(replylist.pk, (7, 0, 0), (2, 0, 0))],
+                ReplyList.objects.recount(fix=False))
+        self.assertEqual(self.counts('jenga'), (7, 0, 0))
+
+        ReplyList.objects.recount()
+        self.assertEqual(self.counts('jenga'), (2, 0, 0))
+        self.assertEqual([], ReplyList.objects.recount())
+
+class ReplyListCacheTest(RelateEventsToGuests):
+    """
+    Test looking up replylists through the replylist cache.
+
+    """
+
+    def setUp(self):
+        super(ReplyListCacheTest, self).setUp()
+        self.old_cache = replylist_cache.cache
+        replylist_cache.cache = get_cache(
+                'django.core.cache.backends.locmem.LocMemCache')
+        replylist_cache.cache.clear()
+        replylist_cache.reset_stats()
+
+    def tearDown(self):
+        replylist_cache.cache = self.old_cache
+        super(ReplyListCacheTest, self).tearDown()
+
+    def test_replylist_id_is_cached(self):
+        jenga = event('jenga')
+        replylist = ReplyList.objects.get_replylist_for(jenga)
+
+        self.assertNumQueries(0,
+                ReplyList.objects.get_replylist_id_for, jenga)
+        self.assertEqual(replylist.pk,
+                         ReplyList.objects.get_replylist_id_for(jenga))
+        self.assertEqual(replylist_cache.stats(), {'hits': 2, 'misses': 1})
+
+    def test_replylist_is_read_in_one_query(self):
+        jenga = event('jenga')
+        ContentType.objects.get_for_model(jenga)
+
+        # a miss reads the row by event, a hit by primary key.
+        for i in range(2):
+            with self.assertNumQueries(1):
+                replylist = ReplyList.objects.get_replylist_for(jenga)
+            self.assertEqual(jenga, replylist.content_object)
+        self.assertEqual(replylist_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_missing_replylist_is_cached_until_created(self):
+        party = Event(title='party')
+        party.save()
+
+        for i in range(2):
+            self.assertRaises(ReplyList.DoesNotExist,
+                              ReplyList.objects.get_replylist_for, party)
+        self.assertEqual(replylist_cache.stats(), {'hits': 1, 'misses': 1})
+
+        replylist = ReplyList.objects.create_replylist(party)
+        self.assertEqual(replylist, ReplyList.objects.get_replylist_for(party))
+
+    def test_deleted_replylist_is_forgotten(self):
+        jenga = event('jenga')
+        ReplyList.objects.get_replylist_for(jenga).delete()
+
+        self.assertRaises(ReplyList.DoesNotExist,
+                          ReplyList.objects.get_replylist_for, jenga)
+
+class ManyEventsTest(RelateEventsToGuests):
+    """
+    Test looking up the replylists of many events at once.
+
+    """
+
+    def test_get_replylists_for(self):
+        party = Event(title='party')
+        party.save()
+        events = self.events + [party, user('sally')]
+        for event_ in events:
+            ContentType.objects.get_for_model(event_)
+
+        # one query for each event model.
+        with self.assertNumQueries(2):
+            replylists = ReplyList.objects.get_replylists_for(events)
+
+        self.assertEqual(
+                dict((event_, ReplyList.objects.get_replylist_for(event_))
+                     for event_ in self.events),
+                replylists)
+        with self.assertNumQueries(0):
+            for replylist in replylists.values():
+                replylist.content_object
+
+    def test_get_reply_counts_for(self):
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+        Reply.objects.reply_to_event_for(event('bbq'), user('sally'), False)
+
+        self.assertEqual(
+                {event('bbq'): (1, 1, 0),
+                 event('jenga'): (2, 1, 1),
+                 event('cleaning'): (1, 0, 0)},
+                ReplyList.objects.get_reply_counts_for(self.events))
+
+class GuestListPagingTest(CreateEventsBaseCase):
+    """
+    Test ordering guest lists and reading them a page at a time.
+
+    """
+
+    def setUp(self):
+        super(GuestListPagingTest, self).setUp()
+        self.party = event('bbq')
+        ReplyList.objects.create_replylist(self.party,
+                                           guests=User.objects.all())
+        Reply.objects.reply_to_event_for(self.party, user('jim'), True)
+        Reply.objects.reply_to_event_for(self.party, user('jill'), False)
+        Reply.objects.reply_to_event_for(self.party, user('sally'), True)
+        self.replylist_id = ReplyList.objects.get_replylist_id_for(self.party)
+
+    def test_guests_without_ordering(self):
+        replies = ReplyList.objects.get_invited_guests_for(self.party,
+                                                           ordering=())
+        self.assertFalse('ORDER BY' in str(replies.query))
+        self.assertEqual(5, replies.count())
+
+    def test_guests_with_ordering(self):
+        replies = ReplyList.objects.get_confirmed_guests_for(
+                    self.party, ordering=('-guest__username',))
+        self.assertEqual(['sally', 'jim'],
+                         [reply.guest.username for reply in replies])
+
+    def test_keyset_pages(self):
+        pages = []
+        cursor = None
+        while True:
+            last_cursor = cursor
+            replies, cursor = Reply.objects.keyset_page(
+                    self.replylist_id, after=cursor, limit=2)
+            pages.append([reply.guest.username for reply in replies])
+            if cursor is None:
+                break
+
+        # not responded, declined, then attending; by id within each.
+        self.assertEqual([['sven', 'gertrude'], ['jill', 'jim'], ['sally']],
+                         pages)
+
+        # the last page seeks straight to the attending group.
+        with self.assertNumQueries(1):
+            Reply.objects.keyset_page(self.replylist_id, after=last_cursor,
+                                      limit=2)
+
+    def test_keyset_cursor_is_checked(self):
+        for cursor in ('abc', '1.2', '3.0.1'):
+            self.assertRaises(ValueError, Reply.objects.keyset_page,
+                              self.replylist_id, after=cursor)
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads the sqlite catalog')
+    def test_keyset_index_is_created_by_syncdb(self):
+        self.assertTrue('please_reply_reply_replylist_id_d8e7bef4f4636d9'
+                        in reply_indexes())
+
+def reply_indexes():
+    """
+    the names of the indexes on the replies table, on sqlite.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                   "AND tbl_name = %s", [Reply._meta.db_table])
+    return [name for (name,) in cursor.fetchall()]
+
+class ObjectIdFieldTest(RelateEventsToGuests):
+    """
+    Test the column types ReplyList.object_id can be stored in.
+
+    """
+
+    def test_object_id_types(self):
+        self.assertEqual('PositiveIntegerField',
+                         object_id_field('integer').get_internal_type())
+        self.assertEqual(36, object_id_field('uuid').max_length)
+        self.assertEqual(255, object_id_field('char').max_length)
+        self.assertRaises(ValueError, object_id_field, 'float')
+
+    def test_integer_object_id_model(self):
+        """
+        A replylist model built with an integer object_id stores the event
+        pk as a number.
+        """
+        class IntegerReplyList(models.Model):
+            content_type = models.ForeignKey(ContentType)
+            object_id = object_id_field('integer')
+            content_object = generic.GenericForeignKey()
+
+            class Meta:
+                app_label = 'tests'
+                managed = False
+
+        field = IntegerReplyList._meta.get_field('object_id')
+        self.assertEqual(models.PositiveIntegerField().db_type(connection=connection),
+                         field.db_type(connection=connection))
+
+        bbq = event('bbq')
+        replylist = IntegerReplyList(content_object=bbq)
+        self.assertEqual(bbq.pk, replylist.object_id)
+        self.assertEqual(bbq, replylist.content_object)
+        self.assertEqual([bbq.pk], field.get_db_prep_lookup(
+                            'in', [unicode(bbq.pk)], connection=connection))
+
+    def test_uuid_object_id_is_normalised(self):
+        """
+        However a uuid event pk is written, it is looked up in the form
+        migration 0009 converted the stored pks to.
+        """
+        pk = uuid.uuid4()
+        party = UUIDEvent.objects.create(id=pk.hex, title='party')
+        # a reply list as migration 0009 leaves it.
+        replylist = UUIDReplyList.objects.create(
+                content_type=ContentType.objects.get_for_model(UUIDEvent),
+                object_id=str(pk))
+
+        self.assertEqual(replylist,
+                         UUIDReplyList.objects.get_replylist_for(party))
+        self.assertEqual({party: replylist},
+                         UUIDReplyList.objects.get_replylists_for([party]))
+        self.assertEqual(unicode(pk),
+                         UUIDReplyList(content_object=party).object_id)
+
+        for form in (pk.hex.upper(), '{%s}' % pk, pk):
+            self.assertEqual([replylist.pk], list(
+                    UUIDReplyList.objects.filter(object_id=form
+                                        ).values_list('pk', flat=True)))
+        self.assertRaises(ValidationError, UUIDReplyList.objects.filter,
+                          object_id='x' * 40)
+
+    def test_lookups_match_event_pk(self):
+        events = [event('bbq'), event('jenga')]
+        self.assertEqual(set(events),
+                         set(ReplyList.objects.get_replylists_for(events)))
+        self.assertEqual(events[0],
+                         ReplyList.objects.get_replylist_for(events[0]
+                                    ).content_object)
@@ -1,6 +1,10 @@
 from django.db import models
+from django.contrib.contenttypes import generic
+from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import slugify
 
+from please_reply.models import ReplyListManager, object_id_field
+
 class Event(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=512)
@@ -15,3 +19,22 @@ class Event(models.Model):
 
         super(Event, self).save()
 
+
+class UUIDEvent(models.Model):
+    """
+    An event keyed by a uuid kept as 32 hex digits.
+
+    """
+    id = models.CharField(max_length=32, primary_key=True)
+    title = models.CharField(max_length=255)
+
+class UUIDReplyList(models.Model):
+    """
+    A reply list for PLEASE_REPLY_OBJECT_ID_TYPE = 'uuid'.
+
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = object_id_field('uuid')
+    content_object = generic.GenericForeignKey()
+
+    objects = ReplyListManager()
@@ -8,7 +8,11 @@ this_dir = lambda name: os.path.join(os.path.dirname(__file__), name)
 
 if not settings.configured:
     settings.configure(
-      DATABASE_ENGINE='sqlite3',
+      DATABASES={
+          'default': {'ENGINE': 'django.db.backends.sqlite3'},
+          # an empty second database for ReplicaRouterTest to read from.
+          'replica': {'ENGINE': 'django.db.backends.sqlite3'},
+      },
       INSTALLED_APPS=[
           'django.contrib.contenttypes',
           'django.contrib.auth',
@@ -1,16 +1,46 @@
+import os
+import socket
+import tempfile
+from datetime import datetime
+from StringIO import StringIO
 from functools import partial
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.urlresolvers import reverse
+from django.db import router, connection
+from django.db.models import signals
+from django.http import Http404
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
+from django.utils import simplejson
+from django.utils.unittest import skipUnless
 
 from please_reply import exceptions
 from please_reply import settings as backup_settings
+from please_reply import userhash
+from please_reply import export
+from please_reply import (models, views, throttle, instrument, routers,
+                          invitations)
+from please_reply.buffer import (LocalReplyBuffer, CacheReplyBuffer,
+                                 get_reply_buffer)
 from please_reply.tests.models import Event
-from please_reply.models import ReplyList, Reply, encode_userhash
+from please_reply.tests.model_tests import reply_indexes
+from please_reply.models import (ReplyList, Reply, encode_userhash,
+                                 track_event_identifier,
+                                 tracked_event_identifiers)
+from please_reply.views import decorators
+from please_reply.views.decorators import validate_please_reply_uri
+from please_reply.codec import encode_token
+from please_reply.management.commands import flush_replies
+from please_reply.invitations import iter_invitation_links, send_invitations
 
 #--------------------------------------------------------------
 # Constants
@@ -87,6 +117,20 @@ class RelateEventsToGuests(CreateEventsBaseCase):
                     event,
                     guests=guests
             )
+
+class StaffRelateEventsToGuests(RelateEventsToGuests):
+    """
+    Logs the test client in as a superuser, for the replylist admin views.
+
+    """
+
+    def setUp(self):
+        super(StaffRelateEventsToGuests, self).setUp()
+        staff = User.objects.create_user('staff', 'staff@example.com', 'staff')
+        staff.is_superuser = True
+        staff.save()
+        self.client.login(username='staff', password='staff')
+
 class ReplyFormReply(RelateEventsToGuests):
     """
     Test that guest can reply using the reply form,
@@ -118,6 +162,10 @@ class ReplyFormReply(RelateEventsToGuests):
         self.assertTrue(
                 Reply.objects.get(guest=_user, attending=True).responded)
 
+        replylist = ReplyList.objects.get_replylist_for(_event)
+        self.assertEqual(replylist.responded_count, 1)
+        self.assertEqual(replylist.attending_count, 1)
+
     def test_user_changes_mind(self):
         """
         User changes mind many times on whether or not to attend.
@@ -141,6 +189,27 @@ class ReplyFormReply(RelateEventsToGuests):
         self.assertTrue(
                 ReplyList.objects.is_guest_attending(_event, _user))
 
+    def test_repeated_reply_doesnt_write(self):
+        """
+        Accepting a second time leaves the reply and the counts alone.
+
+        """
+        _event = event('jenga')
+        _user = user('sven')
+
+        response = self._user_replies_to_event(_user, _event, "yes")
+        self.assertTrue(response.context['reply_changed'])
+        modified_at = Reply.objects.get(guest=_user).modified_at
+
+        response = self._user_replies_to_event(_user, _event, "yes")
+        self.assertFalse(response.context['reply_changed'])
+
+        self.assertEqual(modified_at,
+                         Reply.objects.get(guest=_user).modified_at)
+        replylist = ReplyList.objects.get_replylist_for(_event)
+        self.assertEqual(replylist.responded_count, 1)
+        self.assertEqual(replylist.attending_count, 1)
+
     def test_no_one_elses_records_change(self):
         """
         One person accepting does not affect any other attendees.
@@ -254,6 +323,92 @@ class ReplyFormViewTest(RelateEventsToGuests):
                     404,
                     userhash='aL8-8Ozuc-XE',
         )
+    def test_validate_please_reply_uri_query_budget(self):
+        """
+        The reply and replylist are fetched together and the event is only
+        checked for existence.
+
+        """
+        _event = event('bbq')
+        replylist = ReplyList.objects.get_replylist_for(_event)
+        ContentType.objects.get_for_id(replylist.content_type_id)
+
+        view = validate_please_reply_uri(lambda request, **kws: kws)
+        kws = dict(slug=_event.slug,
+                   reply_list_id=str(replylist.pk),
+                   user_hash=encode_userhash(user('sally').pk,
+                                             replylist.pk, SALT),
+                   slug_field='slug')
+
+        with self.assertNumQueries(2):
+            kws = view(RequestFactory().get('/'), **kws)
+
+        self.assertEqual(kws['object'],
+                         Reply.objects.get(replylist=replylist,
+                                           guest=user('sally')))
+
+    def test_validate_please_reply_uri_copies_extra_context(self):
+        """
+        The extra_context given with the url pattern isn't changed, so one
+        guest's reply doesn't leak into the next request.
+
+        """
+        _event = event('bbq')
+        replylist = ReplyList.objects.get_replylist_for(_event)
+        shared = {'title': 'bbq'}
+
+        view = validate_please_reply_uri(lambda request, **kws: kws)
+        kws = view(RequestFactory().get('/'),
+                   slug=_event.slug,
+                   reply_list_id=str(replylist.pk),
+                   user_hash=encode_userhash(user('sally').pk,
+                                             replylist.pk, SALT),
+                   extra_context=shared)
+
+        self.assertEqual(shared, {'title': 'bbq'})
+        self.assertEqual(kws['extra_context']['title'], 'bbq')
+        self.assertEqual(kws['extra_context']['object'], kws['object'])
+
+    def test_view_event_with_signed_userhash(self):
+        """
+        Signed user hashes are accepted for their own reply list only.
+
+        """
+        replylist = ReplyList.objects.get_replylist_for(event('bbq'))
+        userpk = user('sally').pk
+        signing_key = userhash.signing_key(SALT)
+
+        self._user_views_event_statuscode_expected(
+                    user('sally'),
+                    event('bbq'),
+                    200,
+                    userhash=encode_token(userpk, replylist.pk, signing_key),
+        )
+
+        self._user_views_event_statuscode_expected(
+                    user('sally'),
+                    event('bbq'),
+                    404,
+                    userhash=encode_token(userpk, replylist.pk + 1,
+                                          signing_key),
+        )
+
+    def test_legacy_userhash_can_be_turned_off(self):
+        """
+        Once PLEASE_REPLY_ACCEPT_LEGACY_USERHASH is off, only signed user
+        hashes are accepted.
+
+        """
+        userhash.ACCEPT_LEGACY_USERHASH = False
+        try:
+            self._user_views_event_statuscode_expected(
+                        user('sally'),
+                        event('bbq'),
+                        404,
+            )
+        finally:
+            userhash.ACCEPT_LEGACY_USERHASH = True
+
     #----------------------------------------------------------
     # helpers.
 
@@ -286,3 +441,755 @@ class ReplyFormViewTest(RelateEventsToGuests):
         response_test(response)
         return response
 
+
+class InvitationLinksTest(RelateEventsToGuests):
+    """
+    Test building the reply links for a whole guest list.
+
+    """
+
+    def test_invitation_links_match_reversed_urls(self):
+        _event = event('jenga')
+        replylist = ReplyList.objects.get_replylist_for(_event)
+        replylist.content_object
+
+        # one query per chunk of one guest, and one to find the end.
+        with self.assertNumQueries(3):
+            links = list(iter_invitation_links(replylist, chunk_size=1,
+                         base_url='https://example.com/'))
+
+        self.assertEqual(
+                sorted([user('sven').pk, user('sally').pk]),
+                sorted(guest_pk for guest_pk, form_url, urls in links))
+
+        for guest_pk, form_url, response_urls in links:
+            kwargs = dict(slug=_event.slug,
+                          reply_list_id=replylist.pk,
+                          user_hash=encode_userhash(guest_pk, replylist.pk, SALT))
+
+            self.assertEqual(
+                    'https://example.com' +
+                    reverse('please_reply_reply_form', kwargs=kwargs),
+                    form_url)
+            self.assertEqual(
+                    'https://example.com' +
+                    reverse('please_reply_replied',
+                            kwargs=dict(kwargs, response='accept')),
+                    response_urls['accept'])
+            self.assertEqual(['accept', 'decline'], sorted(response_urls))
+
+    def test_invitation_links_work(self):
+        replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+
+        for guest_pk, form_url, response_urls in iter_invitation_links(
+                replylist, replies=Reply.objects.filter(guest=user('sven')),
+                base_url=''):
+            self.assertEqual(self.client.get(form_url).status_code, 200)
+            self.client.get(response_urls['accept'])
+
+        self.assertEqual(
+                [user('sven')],
+                guests(ReplyList.objects.get_confirmed_guests_for(
+                       event('jenga'))))
+
+class ExportRepliesTest(StaffRelateEventsToGuests):
+    """
+    Test streaming a reply list as CSV and JSON lines.
+
+    """
+
+    def setUp(self):
+        super(ExportRepliesTest, self).setUp()
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+        self.replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+
+    def export(self, format):
+        response = self.client.get(reverse('please_reply_export',
+                kwargs=dict(reply_list_id=self.replylist.pk, format=format)))
+        self.assertEqual(response.status_code, 200)
+        return response.content.splitlines()
+
+    def test_export_csv(self):
+        lines = self.export('csv')
+
+        self.assertEqual(lines[0], ','.join(export.EXPORT_FIELDS))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(
+            any(line.startswith('sven,,,sven@example.com,True,True,')
+                for line in lines))
+
+    def test_export_jsonl(self):
+        rows = [simplejson.loads(line) for line in self.export('jsonl')]
+
+        self.assertEqual(
+                [('sally', False), ('sven', True)],
+                sorted((row['guest__username'], row['attending'])
+                       for row in rows))
+
+    def test_export_reads_in_chunks(self):
+        self.assertEqual(
+                sorted(['sally', 'sven']),
+                sorted(row['guest__username'] for row in
+                       export.iter_reply_values(self.replylist, chunk_size=1)))
+
+    def test_export_requires_permission(self):
+        self.client.logout()
+        response = self.client.get(reverse('please_reply_export',
+                kwargs=dict(reply_list_id=self.replylist.pk, format='csv')))
+        self.assertEqual(response.status_code, 302)
+
+class ConditionalRequestsTest(StaffRelateEventsToGuests):
+    """
+    Test the reply form and the replylist summary answer conditional GETs.
+
+    """
+
+    def setUp(self):
+        super(ConditionalRequestsTest, self).setUp()
+        self.replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+
+    def form_uri(self, guest):
+        return reverse('please_reply_reply_form', kwargs=dict(
+                        slug=event('jenga').slug,
+                        reply_list_id=self.replylist.pk,
+                        user_hash=encode_userhash(guest.pk,
+                                                  self.replylist.pk, SALT)))
+
+    def summary_uri(self):
+        return reverse('please_reply_summary',
+                       kwargs=dict(reply_list_id=self.replylist.pk))
+
+    def test_reply_form_not_modified(self):
+        response = self.client.get(self.form_uri(user('sven')))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(self.form_uri(user('sven')),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_reply_form_changes_after_reply(self):
+        etag = self.client.get(self.form_uri(user('sven')))['ETag']
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+
+        response = self.client.get(self.form_uri(user('sven')),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_summary(self):
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+        response = self.client.get(self.summary_uri())
+        summary = simplejson.loads(response.content)
+
+        self.assertEqual((2, 1, 1), (summary['invited'],
+                                     summary['responded'],
+                                     summary['attending']))
+
+    def test_summary_not_modified_until_counts_change(self):
+        etag = self.client.get(self.summary_uri())['ETag']
+        request = self.factory_request(HTTP_IF_NONE_MATCH=etag)
+
+        with self.assertNumQueries(1):
+            response = views.replylist_summary(
+                    request, reply_list_id=self.replylist.pk)
+        self.assertEqual(response.status_code, 304)
+
+        Reply.objects.reply_to_event_for(event('jenga'), user('sally'), False)
+        response = self.client.get(self.summary_uri(),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_summary_modified_when_counts_change_back(self):
+        etag = self.client.get(self.summary_uri())['ETag']
+
+        # one reply changed and another changed back, between two polls.
+        ReplyList.objects.filter(pk=self.replylist.pk).update(
+                modified_at=datetime(2030, 1, 1))
+        response = self.client.get(self.summary_uri(),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def factory_request(self, **extra):
+        request = RequestFactory().get(self.summary_uri(), **extra)
+        request.user = user('staff')
+        return request
+
+    def test_summary_requires_permission(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.summary_uri()).status_code, 302)
+
+class ChangeFeedTest(StaffRelateEventsToGuests):
+    """
+    Test reading the replies changed since a cursor.
+
+    """
+
+    def changes(self, reply_list_id=None, **params):
+        if reply_list_id is None:
+            uri = reverse('please_reply_changes')
+        else:
+            uri = reverse('please_reply_replylist_changes',
+                          kwargs=dict(reply_list_id=reply_list_id))
+        response = self.client.get(uri, params)
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def test_feed_pages_through_all_replies(self):
+        seen = []
+        feed = {'cursor': '', 'more': True}
+        while feed['more']:
+            feed = self.changes(after=feed['cursor'], limit=3)
+            seen.extend(change['id'] for change in feed['changes'])
+
+        self.assertEqual(sorted(Reply.objects.values_list('id', flat=True)),
+                         sorted(seen))
+        self.assertEqual(len(seen), len(set(seen)))
+
+        # nothing new, the cursor stays put.
+        self.assertEqual({'changes': [], 'cursor': feed['cursor'],
+                          'more': False},
+                         self.changes(after=feed['cursor']))
+
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+        changes = self.changes(after=feed['cursor'])['changes']
+        self.assertEqual([(user('sven').pk, True, True)],
+                         [(change['guest_id'], change['responded'],
+                           change['attending']) for change in changes])
+
+    def test_feed_for_one_replylist(self):
+        replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+        feed = self.changes(replylist.pk)
+
+        guest_ids = [change['guest_id'] for change in feed['changes']]
+        self.assertEqual(sorted([user('sally').pk, user('sven').pk]),
+                         sorted(guest_ids))
+        self.assertEqual(set([replylist.pk]),
+                         set(change['reply_list_id']
+                             for change in feed['changes']))
+
+    def test_feed_page_size_is_bounded(self):
+        old_max_page = models.CHANGES_MAX_PAGE
+        models.CHANGES_MAX_PAGE = 2
+        try:
+            self.assertEqual(2, len(self.changes(limit=100)['changes']))
+        finally:
+            models.CHANGES_MAX_PAGE = old_max_page
+
+    def test_feed_rejects_bad_cursor(self):
+        for params in ({'after': 'nonsense'}, {'limit': 0}):
+            response = self.client.get(reverse('please_reply_changes'),
+                                       params)
+            self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads the sqlite catalog')
+    def test_feed_indexes_are_created_by_syncdb(self):
+        indexes = reply_indexes()
+        self.assertTrue('please_reply_reply_replylist_id_a3efb46a27b635c'
+                        in indexes)
+        self.assertEqual(1, len([name for name in indexes
+                                 if name.endswith('_e9606837')]))
+
+class RefusingEmailBackend(BaseEmailBackend):
+    """
+    A mail server that can't be reached.
+    """
+
+    def open(self):
+        raise socket.error('connection refused')
+
+class SendInvitationsTest(RelateEventsToGuests):
+    """
+    Test emailing invitations to the guests who haven't responded.
+
+    """
+
+    def setUp(self):
+        super(SendInvitationsTest, self).setUp()
+        self.replylist = ReplyList.objects.get_replylist_for(event('jenga'))
+        self.checkpoint = tempfile.mktemp()
+
+    def tearDown(self):
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        super(SendInvitationsTest, self).tearDown()
+
+    def test_send_invitations_to_guests_not_responded(self):
+        Reply.objects.reply_to_event_for(event('jenga'), user('sven'), True)
+
+        sent = send_invitations(self.replylist, workers=2, chunk_size=1,
+                                base_url='https://example.com')
+
+        self.assertEqual(sent, 1)
+        self.assertEqual([['sally@example.com']],
+                         [message.to for message in mail.outbox])
+
+        links = dict((guest_pk, (form_url, response_urls))
+                     for guest_pk, form_url, response_urls
+                     in iter_invitation_links(self.replylist, base_url=''))
+        form_url, response_urls = links[user('sally').pk]
+        body = mail.outbox[0].body
+        self.assertTrue('https://example.com' + form_url in body)
+        self.assertTrue('https://example.com' + response_urls['decline']
+                        in body)
+
+    @skipUnless('django.contrib.sites' in settings.INSTALLED_APPS,
+                'the sites framework is not installed')
+    def test_links_default_to_current_site(self):
+        from django.contrib.sites.models import Site
+
+        send_invitations(self.replylist)
+
+        domain = 'http://%s/' % Site.objects.get_current().domain
+        self.assertTrue(domain in mail.outbox[0].body)
+
+    def test_send_invitations_resumes_from_checkpoint(self):
+        call_command('send_invitations', str(self.replylist.pk),
+                     checkpoint=self.checkpoint, workers=3,
+                     base_url='https://example.com', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertTrue('https://example.com/' in mail.outbox[0].body)
+
+        ReplyList.objects.create_replylist(event('jenga'),
+                guests=[user('gertrude')])
+        call_command('send_invitations', str(self.replylist.pk),
+                     checkpoint=self.checkpoint,
+                     base_url='https://example.com', stdout=StringIO())
+
+        self.assertEqual(
+                ['gertrude@example.com', 'sally@example.com',
+                 'sven@example.com'],
+                sorted(message.to[0] for message in mail.outbox))
+
+    def test_send_invitations_stops_when_mail_server_is_down(self):
+        old_backend = settings.EMAIL_BACKEND
+        settings.EMAIL_BACKEND = ('please_reply.tests.views_tests.'
+                                  'RefusingEmailBackend')
+        try:
+            self.assertRaises(socket.error, send_invitations,
+                              self.replylist, workers=2, base_url='')
+        finally:
+            settings.EMAIL_BACKEND = old_backend
+
+        self.assertEqual(set(), invitations.read_checkpoint(self.checkpoint))
+
+    def test_interrupted_send_checkpoints_every_email_sent(self):
+        ReplyList.objects.create_replylist(event('jenga'),
+                                           guests=User.objects.all())
+        old_email_message = invitations.EmailMessage
+        made = []
+
+        def interrupting_email_message(*args):
+            if len(made) == 3:
+                raise KeyboardInterrupt
+            made.append(args)
+            return old_email_message(*args)
+
+        invitations.EmailMessage = interrupting_email_message
+        try:
+            self.assertRaises(KeyboardInterrupt, send_invitations,
+                              self.replylist, workers=2, chunk_size=10,
+                              checkpoint=self.checkpoint, base_url='')
+        finally:
+            invitations.EmailMessage = old_email_message
+
+        emailed = set(Reply.objects.filter(replylist=self.replylist,
+                guest__email__in=[message.to[0] for message in mail.outbox]
+                ).values_list('pk', flat=True))
+        self.assertEqual(emailed, invitations.read_checkpoint(self.checkpoint))
+
+        # the rest are sent when the run is started again.
+        send_invitations(self.replylist, checkpoint=self.checkpoint,
+                         base_url='')
+        self.assertEqual(
+                sorted(user.email for user in User.objects.all()),
+                sorted(message.to[0] for message in mail.outbox))
+
+class TrackedEventIdentifierTest(CreateEventsBaseCase):
+    """
+    Test checking reply links against the event slug copied onto the
+    replylist.
+
+    """
+
+    def setUp(self):
+        super(TrackedEventIdentifierTest, self).setUp()
+        track_event_identifier(Event, 'slug')
+
+        self.replylist = ReplyList.objects.create_replylist(
+                event('bbq'), guests=[user('sally')])
+
+    def tearDown(self):
+        tracked_event_identifiers.pop(Event)
+        signals.post_save.disconnect(sender=Event,
+                dispatch_uid='please_reply.event_identifier')
+        super(TrackedEventIdentifierTest, self).tearDown()
+
+    def test_identifier_follows_event(self):
+        self.assertEqual(self.replylist.event_identifier, 'bbq')
+
+        bbq = event('bbq')
+        bbq.slug = 'beach-bbq'
+        bbq.save()
+
+        self.assertEqual(
+                ReplyList.objects.get(pk=self.replylist.pk).event_identifier,
+                'beach-bbq')
+
+    def test_validate_uri_skips_event_table(self):
+        ContentType.objects.get_for_id(self.replylist.content_type_id)
+        view = validate_please_reply_uri(lambda request, **kws: kws)
+        user_hash = encode_userhash(user('sally').pk, self.replylist.pk, SALT)
+
+        def validate(slug):
+            return view(RequestFactory().get('/'),
+                        slug=slug,
+                        reply_list_id=str(self.replylist.pk),
+                        user_hash=user_hash,
+                        slug_field='slug')
+
+        with self.assertNumQueries(1):
+            validate('bbq')
+        self.assertRaises(Http404, validate, 'jenga')
+
+class InvalidLinkThrottleTest(RelateEventsToGuests):
+    """
+    Test that failing reply links are remembered and throttled per ip.
+
+    """
+
+    def setUp(self):
+        super(InvalidLinkThrottleTest, self).setUp()
+        self.now = 1000.0
+        self.old_throttle = decorators.failure_throttle
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.clear()
+        decorators.failure_throttle = throttle.TokenBucketThrottle(
+                cache, burst=2, rate=0.5, clock=lambda: self.now)
+        throttle.invalid_hashes.clear()
+
+        self.view = validate_please_reply_uri(lambda request, **kws: kws)
+        self.replylist = ReplyList.objects.get_replylist_for(event('bbq'))
+
+    def tearDown(self):
+        decorators.failure_throttle = self.old_throttle
+        throttle.invalid_hashes.clear()
+        super(InvalidLinkThrottleTest, self).tearDown()
+
+    def validate(self, user_hash, ip='10.0.0.1'):
+        return self.view(RequestFactory().get('/', REMOTE_ADDR=ip),
+                         slug='bbq',
+                         reply_list_id=str(self.replylist.pk),
+                         user_hash=user_hash,
+                         slug_field='slug')
+
+    def test_invalid_link_is_remembered(self):
+        # sven isn't invited to the bbq, so his link is never going to work.
+        user_hash = encode_userhash(user('sven').pk, self.replylist.pk, SALT)
+        self.assertRaises(Http404, self.validate, user_hash)
+
+        with self.assertNumQueries(0):
+            self.assertRaises(Http404, self.validate, user_hash)
+
+    def test_invited_guest_is_forgotten(self):
+        user_hash = encode_userhash(user('sven').pk, self.replylist.pk, SALT)
+        self.assertRaises(Http404, self.validate, user_hash)
+
+        Reply.objects.create(replylist=self.replylist, guest=user('sven'))
+        self.assertTrue('object' in self.validate(user_hash))
+
+    def test_ip_is_throttled_after_failures(self):
+        self.assertRaises(Http404, self.validate, 'garbage1')
+        self.assertRaises(Http404, self.validate, 'garbage2')
+
+        # the bucket is empty, failing links are turned away for a while.
+        response = self.validate('garbage3')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+
+        # but a good signed link from the same ip still works.
+        user_hash = encode_token(user('sally').pk, self.replylist.pk,
+                                 userhash.signing_key(SALT))
+        self.assertTrue('object' in self.validate(user_hash))
+
+        # another ip isn't affected.
+        self.assertRaises(Http404, self.validate, 'garbage3', ip='10.0.0.2')
+
+        self.now += 2
+        self.assertRaises(Http404, self.validate, 'garbage4')
+
+    def test_throttled_ip_costs_no_queries(self):
+        self.assertRaises(Http404, self.validate, 'garbage1')
+        self.assertRaises(Http404, self.validate, 'garbage2')
+
+        # legacy hashes decode to a guest pk, they aren't even looked up.
+        sven = encode_userhash(user('sven').pk, self.replylist.pk, SALT)
+        sally = encode_userhash(user('sally').pk, self.replylist.pk, SALT)
+        with self.assertNumQueries(0):
+            self.assertEqual(429, self.validate(sven).status_code)
+            self.assertEqual(429, self.validate(sally).status_code)
+
+        # nor are they remembered as invalid once the bucket refills.
+        self.now += 2
+        self.assertTrue('object' in self.validate(sally))
+
+    def test_client_ip(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1',
+                HTTP_X_FORWARDED_FOR='192.168.0.9, 172.16.0.5')
+
+        self.assertEqual('10.0.0.1', throttle.client_ip(request, None))
+        self.assertEqual('172.16.0.5', throttle.client_ip(request,
+                                            'HTTP_X_FORWARDED_FOR'))
+        self.assertEqual('10.0.0.1', throttle.client_ip(request,
+                                            'HTTP_X_REAL_IP'))
+
+class InstrumentationTest(RelateEventsToGuests):
+    """
+    Test measuring manager methods and reply views.
+
+    """
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.stats = instrument.StatsSink()
+        instrument.set_sink(self.stats)
+
+    def tearDown(self):
+        instrument.set_sink(None)
+        super(InstrumentationTest, self).tearDown()
+
+    def test_reply_is_measured(self):
+        jenga = event('jenga')
+        replylist = ReplyList.objects.get_replylist_for(jenga)
+        self.client.get(reverse('please_reply_replied', kwargs=dict(
+                slug=jenga.slug,
+                reply_list_id=replylist.pk,
+                user_hash=encode_userhash(user('sven').pk, replylist.pk, SALT),
+                response='yes')))
+
+        summary = self.stats.summary()
+        for name in ('decode_userhash', 'validate_please_reply_uri',
+                     'replied_view', 'ReplyManager.update_reply',
+                     'ReplyListManager.adjust_counts'):
+            self.assertEqual(1, summary[name]['calls'])
+
+        self.assertEqual(0, summary['decode_userhash']['queries'])
+        self.assertEqual(1, summary['ReplyManager.update_reply']['rows'])
+        self.assertTrue(summary['replied_view']['queries'] >= 2)
+        self.assertEqual([50, 90, 99],
+                         sorted(summary['replied_view']['percentiles']))
+
+    def test_rows_are_counted(self):
+        ReplyList.objects.get_reply_counts_for(self.events)
+        calls = self.stats.calls['ReplyListManager.get_reply_counts_for']
+        self.assertEqual(len(self.events), calls['rows'])
+
+    def test_nothing_is_measured_without_a_sink(self):
+        instrument.set_sink(None)
+        ReplyList.objects.get_replylist_for(event('bbq'))
+        self.assertEqual({}, self.stats.summary())
+
+    def test_percentiles(self):
+        for ms in range(1, 101):
+            self.stats.record('call', ms / 1000.0, 0, None)
+        self.assertEqual({50: 0.051, 90: 0.091, 99: 0.1},
+                         self.stats.percentiles('call'))
+
+@skipUnless('replica' in settings.DATABASES,
+            "needs a second database named 'replica'")
+class ReplicaRouterTest(RelateEventsToGuests):
+    """
+    Test reading from a replica, and from the primary after a reply.
+
+    The replica is a second, empty database, so reads that reach it find
+    nothing.
+
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaRouterTest, self).setUp()
+        self.old_replicas = routers.REPLICA_DATABASES
+        routers.REPLICA_DATABASES = ('replica',)
+        router.routers.insert(0, routers.ReplicaRouter())
+        get_cache(routers.STICKY_CACHE).clear()
+
+        self.replylist_id = ReplyList.objects.using('default').get(
+                object_id=event('jenga').pk).pk
+
+    def tearDown(self):
+        router.routers.pop(0)
+        routers.REPLICA_DATABASES = self.old_replicas
+        super(ReplicaRouterTest, self).tearDown()
+
+    def reply_form(self, guest):
+        uri = reverse('please_reply_reply_form', kwargs=dict(
+                        slug='jenga',
+                        reply_list_id=self.replylist_id,
+                        user_hash=encode_userhash(guest.pk, self.replylist_id,
+                                                  SALT)))
+        return self.client.get(uri)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(0, Reply.objects.count())
+        self.assertEqual(4, Reply.objects.using('default').count())
+        self.assertEqual('default', router.db_for_write(Reply))
+        self.assertEqual('default', router.db_for_read(User))
+
+    def test_reply_sticks_guest_to_primary(self):
+        reply = Reply.objects.using('default').get(
+                    replylist=self.replylist_id, guest=user('sven'))
+        Reply.objects.update_reply(reply, responded=True, attending=True)
+
+        self.assertTrue(routers.is_stuck(self.replylist_id, user('sven').pk))
+        self.assertFalse(routers.is_stuck(self.replylist_id, user('sally').pk))
+
+        # sven's reply is read back from the primary, sally's from the
+        # replica where it can't be found.
+        self.assertEqual(self.reply_form(user('sven')).status_code, 200)
+        self.assertEqual(self.reply_form(user('sally')).status_code, 404)
+
+        with routers.primary_reads(
+                routers.is_stuck(self.replylist_id, user('sven').pk)):
+            self.assertEqual(1, Reply.objects.filter(attending=True).count())
+        self.assertEqual(0, Reply.objects.filter(attending=True).count())
+
+    def test_bulk_invites_check_the_primary(self):
+        replylist, existing, new = ReplyList.objects.bulk_create_replylist(
+                event('jenga'), User.objects.all())
+        self.assertEqual((existing, new), (2, 3))
+
+        inserted = ReplyList.objects._insert_blank_replies(
+                replylist, [user('sally').pk, user('sven').pk])
+        self.assertEqual(0, inserted)
+        self.assertEqual(5, Reply.objects.using('default').filter(
+                                replylist=replylist).count())
+
+class BufferedRepliesTest(RelateEventsToGuests):
+    """
+    Test recording replies in the reply buffer and writing them later.
+
+    """
+    buffer_modules = (models, views, decorators, flush_replies)
+
+    def make_buffer(self):
+        return LocalReplyBuffer()
+
+    def setUp(self):
+        super(BufferedRepliesTest, self).setUp()
+        self.buffer = self.make_buffer()
+        self.old_buffers = [module.reply_buffer
+                            for module in self.buffer_modules]
+        for module in self.buffer_modules:
+            module.reply_buffer = self.buffer
+
+    def tearDown(self):
+        for module, old_buffer in zip(self.buffer_modules, self.old_buffers):
+            module.reply_buffer = old_buffer
+        super(BufferedRepliesTest, self).tearDown()
+
+    def reply(self, guest, title, response):
+        _event = event(title)
+        replylist = ReplyList.objects.get_replylist_for(_event)
+
+        return self.client.get(reverse('please_reply_replied',
+                kwargs=dict(
+                    slug=_event.slug,
+                    reply_list_id=replylist.pk,
+                    user_hash=encode_userhash(guest.pk, replylist.pk, SALT),
+                    response=response,
+                )
+        ))
+
+    def test_replies_are_written_on_flush(self):
+        jenga = event('jenga')
+
+        self.reply(user('sven'), 'jenga', 'no')
+        self.reply(user('sven'), 'jenga', 'yes')
+        self.reply(user('sally'), 'jenga', 'no')
+
+        # nothing is written yet, but guests see their own reply.
+        self.assertEqual(Reply.objects.filter(responded=True).count(), 0)
+        self.assertTrue(ReplyList.objects.is_guest_attending(jenga, user('sven')))
+        self.assertEqual(
+                {user('sven').pk: (True, True),
+                 user('sally').pk: (True, False)},
+                ReplyList.objects.attending_map(jenga))
+
+        self.assertEqual(Reply.objects.flush_buffered_replies(), 2)
+        self.assertEqual(Reply.objects.flush_buffered_replies(), 0)
+
+        self.assertEqual(
+                [user('sven')],
+                guests(ReplyList.objects.get_confirmed_guests_for(jenga)))
+        replylist = ReplyList.objects.get_replylist_for(jenga)
+        self.assertEqual(
+                (2, 2, 1),
+                (replylist.invited_count,
+                 replylist.responded_count,
+                 replylist.attending_count))
+
+    def test_reply_added_while_flushing_is_kept(self):
+        self.reply(user('sven'), 'jenga', 'yes')
+        replies = self.buffer.drain()
+        self.reply(user('sven'), 'jenga', 'no')
+        self.buffer.done(replies)
+
+        self.assertEqual(
+                [(ReplyList.objects.get_replylist_id_for(event('jenga')),
+                  user('sven').pk,
+                  {'responded': True})],
+                self.buffer.drain())
+
+    def flush_replies(self):
+        command = flush_replies.Command()
+        command.stdout = StringIO()
+        command.handle_noargs(interval=0)
+        return command.stdout.getvalue()
+
+    def test_flush_replies_command(self):
+        """
+        Another process can't flush a local buffer.
+        """
+        self.reply(user('sven'), 'jenga', 'yes')
+
+        self.assertRaises(CommandError, self.flush_replies)
+        self.assertEqual(1, len(self.buffer.drain()))
+
+class CacheBufferedRepliesTest(BufferedRepliesTest):
+
+    def make_buffer(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.clear()
+        return CacheReplyBuffer(cache)
+
+    def test_flush_replies_command(self):
+        self.reply(user('sven'), 'jenga', 'yes')
+
+        self.assertEqual("1 buffered reply(s) written.\n",
+                         self.flush_replies())
+        self.assertEqual(
+                [user('sven')],
+                guests(ReplyList.objects.get_confirmed_guests_for(
+                       event('jenga'))))
+
+    def test_only_shared_caches_are_shared(self):
+        self.assertFalse(get_reply_buffer(
+                'django.core.cache.backends.locmem.LocMemCache').shared)
+        self.assertTrue(get_reply_buffer(
+                'file://%s' % tempfile.gettempdir()).shared)
+        self.assertRaises(ImproperlyConfigured, get_reply_buffer,
+                'django.core.cache.backends.dummy.DummyCache')
+
+    def test_lost_reply_is_skipped(self):
+        self.reply(user('sven'), 'jenga', 'yes')
+        self.buffer.cache.delete(self.buffer.reply_key(1))
+        self.reply(user('sally'), 'jenga', 'yes')
+
+        # the first drain waits for the missing reply, the next skips it.
+        self.assertEqual(Reply.objects.flush_buffered_replies(), 0)
+        self.assertEqual(Reply.objects.flush_buffered_replies(), 1)
+        self.assertEqual(
+                [user('sally')],
+                guests(ReplyList.objects.get_confirmed_guests_for(
+                       event('jenga'))))
@@ -0,0 +1,201 @@
+"""
+Turns away reply links that keep failing validation before any decoding or
+database work is done for them.
+
+Two guards are used by validate_please_reply_uri:
+
+    invalid_hashes:
+
+        remembers (reply_list_id, user_hash) pairs that failed to decode or
+        didn't belong to an invited guest, in this process only. at most
+        PLEASE_REPLY_INVALID_HASH_CACHE_SIZE pairs are kept for
+        PLEASE_REPLY_INVALID_HASH_TIMEOUT seconds, 0 disables it.
+
+    failure_throttle:
+
+        a token bucket per client ip, kept in the cache named by
+        PLEASE_REPLY_THROTTLE_CACHE (None disables it). each failed link
+        takes a token and tokens come back at PLEASE_REPLY_THROTTLE_RATE per
+        second up to PLEASE_REPLY_THROTTLE_BURST. while the bucket is empty
+        the client's failing links get a 429 rather than a 404, without any
+        database work: only signed user hashes, which can't be guessed, are
+        checked, so a guest behind the same proxy as a scanner can still use
+        a signed link.
+
+        the client ip is REMOTE_ADDR, or behind a proxy the request header
+        named by PLEASE_REPLY_THROTTLE_IP_HEADER, see client_ip.
+
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from please_reply import settings as backup_settings
+
+#-----------------------------------------------------------------------------
+# settings.
+
+INVALID_HASH_CACHE_SIZE = getattr(
+                settings,
+               'PLEASE_REPLY_INVALID_HASH_CACHE_SIZE',
+                backup_settings.PLEASE_REPLY_INVALID_HASH_CACHE_SIZE)
+
+INVALID_HASH_TIMEOUT = getattr(
+                settings,
+               'PLEASE_REPLY_INVALID_HASH_TIMEOUT',
+                backup_settings.PLEASE_REPLY_INVALID_HASH_TIMEOUT)
+
+THROTTLE_CACHE = getattr(
+                settings,
+               'PLEASE_REPLY_THROTTLE_CACHE',
+                backup_settings.PLEASE_REPLY_THROTTLE_CACHE)
+
+THROTTLE_BURST = getattr(
+                settings,
+               'PLEASE_REPLY_THROTTLE_BURST',
+                backup_settings.PLEASE_REPLY_THROTTLE_BURST)
+
+THROTTLE_RATE = getattr(
+                settings,
+               'PLEASE_REPLY_THROTTLE_RATE',
+                backup_settings.PLEASE_REPLY_THROTTLE_RATE)
+
+THROTTLE_IP_HEADER = getattr(
+                settings,
+               'PLEASE_REPLY_THROTTLE_IP_HEADER',
+                backup_settings.PLEASE_REPLY_THROTTLE_IP_HEADER)
+
+#-----------------------------------------------------------------------------
+# negative cache.
+
+class InvalidHashCache(object):
+    """
+    A bounded set of (reply_list_id, user_hash) pairs known to be invalid.
+
+    Pairs are kept in two generations of at most size pairs each: when the
+    newest generation is full it replaces the oldest, so memory stays bounded
+    without keeping any ordering. Pairs expire after timeout seconds, in case
+    the guest is invited after all.
+    """
+
+    def __init__(self, size=INVALID_HASH_CACHE_SIZE,
+                 timeout=INVALID_HASH_TIMEOUT, clock=time.time):
+        self.size = size
+        self.timeout = timeout
+        self.clock = clock
+        self.clear()
+
+    def key(self, reply_list_id, user_hash):
+        return (unicode(reply_list_id), unicode(user_hash))
+
+    def __contains__(self, pair):
+        if not self.size:
+            return False
+
+        key = self.key(*pair)
+        expires = self._new.get(key) or self._old.get(key)
+        return expires is not None and expires > self.clock()
+
+    def add(self, reply_list_id, user_hash):
+        if not self.size:
+            return
+
+        if len(self._new) >= self.size:
+            self._old, self._new = self._new, {}
+        self._new[self.key(reply_list_id, user_hash)] = (
+                self.clock() + self.timeout)
+
+    def clear(self):
+        self._new = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._new) + len(self._old)
+
+invalid_hashes = InvalidHashCache()
+
+def guest_invited(sender, instance, created, **kwargs):
+    """
+    a new guest may own a link that was remembered as invalid, forget them
+    all rather than work out the guest's hash.
+    """
+    if created:
+        invalid_hashes.clear()
+
+#-----------------------------------------------------------------------------
+# rate limiting.
+
+class TokenBucketThrottle(object):
+    """
+    A token bucket per key, stored in a django cache.
+
+    The bucket is stored as (tokens, updated_at) and refilled lazily when it
+    is read. Reads and writes aren't atomic, so concurrent failures from one
+    ip can each take the same token; close enough to slow down a scanner.
+    """
+
+    def __init__(self, cache=None, burst=THROTTLE_BURST, rate=THROTTLE_RATE,
+                 clock=time.time):
+        self.cache = cache
+        self.burst = burst
+        self.rate = rate
+        self.clock = clock
+
+    def key(self, ident):
+        return 'please_reply.throttle.%s' % ident
+
+    def tokens(self, ident):
+        """
+        the tokens left in the bucket of ident right now.
+        """
+        if self.cache is None:
+            return self.burst
+
+        bucket = self.cache.get(self.key(ident))
+        if bucket is None:
+            return self.burst
+
+        tokens, updated_at = bucket
+        elapsed = max(self.clock() - updated_at, 0)
+        return min(self.burst, tokens + elapsed * self.rate)
+
+    def allowed(self, ident):
+        return self.tokens(ident) >= 1
+
+    def charge(self, ident):
+        """
+        take a token from the bucket of ident.
+        """
+        if self.cache is None:
+            return
+
+        tokens = max(self.tokens(ident) - 1, 0)
+        # keep the bucket until it would be full again.
+        timeout = int((self.burst - tokens) / self.rate) + 1
+        self.cache.set(self.key(ident), (tokens, self.clock()), timeout)
+
+    def retry_after(self, ident):
+        """
+        seconds until ident has a token again.
+        """
+        return max(int(math.ceil((1 - self.tokens(ident)) / self.rate)), 1)
+
+failure_throttle = TokenBucketThrottle(
+        get_cache(THROTTLE_CACHE) if THROTTLE_CACHE else None)
+
+def client_ip(request, header=THROTTLE_IP_HEADER):
+    """
+    the ip to throttle a request by: the last address in the header named by
+    header (a request.META key such as 'HTTP_X_FORWARDED_FOR'), which is the
+    one your proxy added, or REMOTE_ADDR when there is no header.
+
+    only name a header your proxy always sets, clients can send any header
+    they like.
+    """
+    if header:
+        addresses = request.META.get(header, '').split(',')
+        if addresses[-1].strip():
+            return addresses[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
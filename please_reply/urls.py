@@ -1,14 +1,29 @@
 from django.conf.urls.defaults import url, patterns, include
 from django.views.generic.simple import direct_to_template
 
-from please_reply.views.decorators import validate_please_reply_uri
-from please_reply.views import replied_view
+from please_reply.views.decorators import (validate_please_reply_uri,
+                                           conditional_reply_view)
+from please_reply.views import (replied_view, export_replies,
+                                replylist_summary, reply_changes)
 from please_reply.models import Reply
 
 urlpatterns = patterns('',
 
+        url(r'^export/(?P<reply_list_id>\d+)\.(?P<format>csv|jsonl)$',
+            export_replies, name='please_reply_export'),
+
+        url(r'^summary/(?P<reply_list_id>\d+)\.json$',
+            replylist_summary, name='please_reply_summary'),
+
+        url(r'^changes\.json$',
+            reply_changes, name='please_reply_changes'),
+
+        url(r'^changes/(?P<reply_list_id>\d+)\.json$',
+            reply_changes, name='please_reply_replylist_changes'),
+
         url(r'^(?P<slug>[-\w]+)\-(?P<reply_list_id>[-\w]+)/(?P<user_hash>[-=\w]+)/$',
-            validate_please_reply_uri(direct_to_template), {
+            validate_please_reply_uri(
+                conditional_reply_view(direct_to_template)), {
             'template'            : 'please_reply/reply_form.html',
             'template_object_name': 'object',
             'slug_field'          : 'slug',
@@ -0,0 +1,80 @@
+"""
+Makes and reads the user hash in reply links in the format chosen by the
+PLEASE_REPLY_USERHASH_FORMAT setting.
+
+"""
+from time import time
+
+from django.conf import settings
+
+from please_reply import settings as backup_settings
+from please_reply.codec import (encode_userhash, decode_userhash,
+                                encode_token, decode_token)
+from please_reply.exceptions import InvalidHash
+from please_reply.instrument import instrumented
+
+#-----------------------------------------------------------------------------
+# settings.
+
+USERHASH_FORMAT = getattr(
+                settings,
+               'PLEASE_REPLY_USERHASH_FORMAT',
+                backup_settings.PLEASE_REPLY_USERHASH_FORMAT)
+
+ACCEPT_LEGACY_USERHASH = getattr(
+                settings,
+               'PLEASE_REPLY_ACCEPT_LEGACY_USERHASH',
+                backup_settings.PLEASE_REPLY_ACCEPT_LEGACY_USERHASH)
+
+SIGNED_USERHASH_MAX_AGE = getattr(
+                settings,
+               'PLEASE_REPLY_SIGNED_USERHASH_MAX_AGE',
+                backup_settings.PLEASE_REPLY_SIGNED_USERHASH_MAX_AGE)
+
+#-----------------------------------------------------------------------------
+# user hashes.
+
+decode_userhash = instrumented('decode_userhash')(decode_userhash)
+
+def signing_key(salt):
+    """
+    Signed user hashes are keyed with the salt and the project SECRET_KEY, so
+    knowing the salt alone isn't enough to forge one.
+    """
+    return '%s%s' % (salt, settings.SECRET_KEY)
+
+def make_userhash(userpk, reply_list_id, salt):
+    """
+    Return the user hash for a guest's reply link.
+    """
+    if USERHASH_FORMAT == 'signed':
+        expires = None
+        if SIGNED_USERHASH_MAX_AGE:
+            expires = time() + SIGNED_USERHASH_MAX_AGE
+        return encode_token(userpk, reply_list_id, signing_key(salt), expires)
+
+    return encode_userhash(userpk, reply_list_id, salt)
+
+def read_userhash(user_hash, reply_list_id, salt,
+                  accept_legacy=True):
+    """
+    Return the guest pk from a user hash made for reply_list_id.
+
+    Signed user hashes are checked first, and are rejected without decoding
+    anything when the signature or reply list is wrong. Legacy user hashes are
+    accepted while PLEASE_REPLY_ACCEPT_LEGACY_USERHASH is on, unless
+    accept_legacy is False.
+
+    Raises InvalidHash if the user hash can't be read.
+    """
+    try:
+        token_list_id, userpk = decode_token(user_hash, signing_key(salt))
+    except InvalidHash:
+        if not (accept_legacy and ACCEPT_LEGACY_USERHASH):
+            raise
+        return decode_userhash(user_hash, reply_list_id, salt)
+
+    if str(token_list_id) != str(reply_list_id):
+        raise InvalidHash('user hash %s was made for reply list %s' %
+                            (user_hash, token_list_id))
+    return userpk
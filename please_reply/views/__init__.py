@@ -3,12 +3,20 @@ A series of views for people to reply to the RSVP invitation they recieved.
 
 """
 from django.conf import settings
-from django.http import Http404, HttpResponse
+from django.contrib.auth.decorators import permission_required
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
+from django.utils import simplejson
+from django.core.serializers.json import DjangoJSONEncoder
+from django.views.decorators.http import condition
 from django.views.generic.simple import direct_to_template
 from django.utils.importlib import import_module
 
 from please_reply import settings as backup_settings
+from please_reply.buffer import reply_buffer
+from please_reply.export import EXPORT_FORMATS
+from please_reply.instrument import instrumented
+from please_reply.models import Reply, ReplyList
 
 HANDLERS = getattr(
             settings,
@@ -25,6 +33,7 @@ def handler_for(response, default=None):
             )
     return _handlers.get(response, default)
 
+@instrumented('replied_view')
 def replied_view(request, *args, **kwargs):
     """
     User has clicked on a valid invitiation response link, it could be any
@@ -94,18 +103,124 @@ def generic_acceptance(request, *args, **kwargs):
     )
 
 def _generic_handler(request, fields, *args, **kwargs):
+    """
+    Set the (fieldname, value) pairs in fields on the guest's reply.
 
+    The reply is only written when it isn't in that state already, so
+    repeated clicks on the same link cost one UPDATE that matches no rows.
+    When PLEASE_REPLY_REPLY_BUFFER is set the reply is only recorded in the
+    buffer, to be written later by Reply.objects.flush_buffered_replies.
+    Whether the reply changed is passed to the template as reply_changed.
+    """
     object_name = kwargs.get('template_object_name', 'object')
     guest_reply = kwargs.get(object_name)
     if not guest_reply:
         raise Http404
 
+    values = dict(fields)
+    if reply_buffer.enabled:
+        changed = any(getattr(guest_reply, fieldname) != value
+                      for fieldname, value in values.items())
+        reply_buffer.add(guest_reply.replylist_id, guest_reply.guest_id,
+                         values)
+        for fieldname, value in values.items():
+            setattr(guest_reply, fieldname, value)
+    else:
+        changed = Reply.objects.update_reply(guest_reply, **values)
+
+    extra_context = kwargs.get('extra_context')
+    if extra_context is not None:
+        extra_context['reply_changed'] = changed
 
-    for fieldname, fieldvalue in fields:
-        setattr(guest_reply, fieldname, fieldvalue)
+    return guest_reply
 
-    guest_reply.save()
+@permission_required('please_reply.change_replylist')
+def export_replies(request, reply_list_id, format='csv'):
+    """
+    Stream the replies of a reply list as CSV or JSON lines.
 
-    return guest_reply
+    The response content is a generator, so rows are sent as they are read.
+    """
+    if format not in EXPORT_FORMATS:
+        raise Http404
 
+    replylist = get_object_or_404(ReplyList, id=reply_list_id)
+    rows, content_type = EXPORT_FORMATS[format]
 
+    response = HttpResponse(rows(replylist), content_type=content_type)
+    response['Content-Disposition'] = (
+            'attachment; filename=replies-%s.%s' % (replylist.pk, format))
+    return response
+
+@permission_required('please_reply.change_replylist')
+def replylist_summary(request, reply_list_id):
+    """
+    The reply counts of a reply list and the time they last changed, as JSON.
+
+    Pollers that send back the ETag or Last-Modified they were given get a
+    304 until the counts change, for the cost of reading one replylist row.
+    """
+    try:
+        summary = ReplyList.objects.filter(pk=reply_list_id).values(
+                    'id', 'invited_count', 'responded_count',
+                    'attending_count', 'modified_at').get()
+    except ReplyList.DoesNotExist:
+        raise Http404
+
+    def etag(request):
+        # counts can come back to the same values, the time tells them apart.
+        return ('%(id)s-%(invited_count)s-%(responded_count)s-'
+                '%(attending_count)s-' % summary +
+                summary['modified_at'].strftime('%Y%m%d%H%M%S%f'))
+
+    def last_modified(request):
+        return summary['modified_at']
+
+    def render(request):
+        content = simplejson.dumps({
+            'reply_list_id': summary['id'],
+            'invited': summary['invited_count'],
+            'responded': summary['responded_count'],
+            'attending': summary['attending_count'],
+            'modified_at': summary['modified_at'],
+            }, cls=DjangoJSONEncoder)
+        return HttpResponse(content, content_type='application/json')
+
+    return condition(etag_func=etag, last_modified_func=last_modified)(render)(request)
+
+@permission_required('please_reply.change_replylist')
+def reply_changes(request, reply_list_id=None):
+    """
+    The replies changed since the cursor in the after parameter, as JSON:
+
+        {"changes": [{"id": .., "reply_list_id": .., "guest_id": ..,
+                      "responded": .., "attending": .., "modified_at": ..},
+                     ...],
+         "cursor": "...",
+         "more": false}
+
+    Pass the cursor back as after to get the next changes, and keep asking
+    straight away while more is true.
+    """
+    try:
+        limit = int(request.GET.get('limit', 100))
+        replies, cursor, more = Reply.objects.changes_since(
+                after=request.GET.get('after') or None,
+                replylist_id=reply_list_id,
+                limit=limit)
+    except ValueError:
+        return HttpResponseBadRequest('invalid after or limit parameter.',
+                                      content_type='text/plain')
+
+    content = simplejson.dumps({
+        'changes': [{'id': reply.pk,
+                     'reply_list_id': reply.replylist_id,
+                     'guest_id': reply.guest_id,
+                     'responded': reply.responded,
+                     'attending': reply.attending,
+                     'modified_at': reply.modified_at}
+                    for reply in replies],
+        'cursor': cursor,
+        'more': more,
+        }, cls=DjangoJSONEncoder)
+    return HttpResponse(content, content_type='application/json')
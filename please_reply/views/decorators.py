@@ -5,13 +5,19 @@ A series of views for people to reply to the RSVP invitation they recieved.
 from functools import wraps
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import get_model
-from django.http import Http404
-from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition
 
 from please_reply import settings as backup_settings
-from please_reply.models import Reply, ReplyList, decode_userhash
+from please_reply.buffer import reply_buffer
+from please_reply.models import Reply, tracked_event_identifiers
+from please_reply.throttle import invalid_hashes, failure_throttle, client_ip
+from please_reply.userhash import read_userhash
 from please_reply.exceptions import InvalidHash
+from please_reply.instrument import instrumented
+from please_reply.routers import primary_reads, follow_stickiness
 
 #-----------------------------------------------------------------------------
 # settings.
@@ -32,9 +38,12 @@ def validate_please_reply_uri(view):
 
         user_hash: 
 
-            an md5 hexdigest of the 
+            the guest's pk, either XOR encoded with a key of
 
-                PLEASE_REPLY_SECRET_SALT + reply_list_id + user_pk
+                PLEASE_REPLY_SECRET_SALT + reply_list_id
+
+            or, with PLEASE_REPLY_USERHASH_FORMAT = 'signed', together with
+            the reply_list_id in a token signed with the same salt.
 
             this is used to uniquely identify the user that was invited to the
             event and to discourage people checking who else is attending the
@@ -65,11 +74,21 @@ def validate_please_reply_uri(view):
             
                 note that I used wedding_slug in place of slug.
 
-    """
+    links that fail are remembered in please_reply.throttle.invalid_hashes,
+    which is checked before the user hash is decoded, and drain the
+    failure_throttle bucket of the client's ip. once the bucket is empty
+    the client only has signed user hashes checked: a legacy user hash
+    decodes to some guest pk that takes a query to turn down, so it gets a
+    429 straight away, as do failing signed ones.
 
-    @wraps(view)
-    def inner(request, *args, **kws):
+    """
 
+    @instrumented('validate_please_reply_uri')
+    def validate(request, kws):
+        """
+        check the uri kws and add the reply to them, or return the response
+        to send instead.
+        """
         user_hash = kws.get('user_hash', None)
         reply_list_id = kws.get('reply_list_id', None)
         slug_field = kws.pop('slug_field', 'slug')
@@ -79,27 +98,73 @@ def validate_please_reply_uri(view):
         # fail early if one of the required params wasn't provided.
         if not (user_hash and reply_list_id and event_identifier):
             raise Http404
-    
+
+        ip = client_ip(request)
+        throttled = not failure_throttle.allowed(ip)
+
+        def reject(remember=True):
+            if remember:
+                invalid_hashes.add(reply_list_id, user_hash)
+
+            if throttled:
+                response = HttpResponse('Too many invalid reply links.',
+                                        content_type='text/plain', status=429)
+                response['Retry-After'] = str(failure_throttle.retry_after(ip))
+                return response
+
+            failure_throttle.charge(ip)
+            raise Http404
+
+        if (reply_list_id, user_hash) in invalid_hashes:
+            return reject(remember=False)
+
         try:
-            userpk = decode_userhash(user_hash, reply_list_id, SECRET_SALT)
+            # a throttled client can't have legacy user hashes looked up.
+            userpk = read_userhash(user_hash, reply_list_id, SECRET_SALT,
+                                   accept_legacy=not throttled)
         except InvalidHash:
-            raise Http404
-    
-        replylist = get_object_or_404(ReplyList, id=reply_list_id)
-    
-        replylist_event_value = getattr(replylist.content_object, slug_field)
-        if  unicode(replylist_event_value) != unicode(event_identifier):
-            raise Http404
-    
-        guestreply = get_object_or_404(
-                        Reply,
-                        guest__pk=userpk,
-                        replylist__id=reply_list_id
-        )
+            # don't remember a legacy link turned away for being throttled.
+            return reject(remember=not throttled)
+
+        # read from the primary database if the guest has just replied.
+        follow_stickiness(reply_list_id, userpk)
+
+        # the reply and its replylist in one query.
+        try:
+            guestreply = Reply.objects.select_related('replylist').get(
+                            guest=userpk,
+                            replylist=reply_list_id
+            )
+        except Reply.DoesNotExist:
+            return reject()
+
+        # check the event without loading it, the content type is cached.
+        replylist = guestreply.replylist
+        event_model = ContentType.objects.get_for_id(
+                        replylist.content_type_id).model_class()
+
+        if (replylist.event_identifier is not None and
+                tracked_event_identifiers.get(event_model) == slug_field):
+            # the replylist has a copy of the event's identifier.
+            event_matches = (unicode(replylist.event_identifier) ==
+                             unicode(event_identifier))
+        else:
+            event_matches = event_model._default_manager.filter(
+                            pk=replylist.object_id,
+                            **{slug_field: event_identifier}
+            ).exists()
+
+        if not event_matches:
+            # the hash is fine, it's the event identifier that's wrong.
+            return reject(remember=False)
+
+        # show the guest their own reply even if it hasn't been written yet.
+        reply_buffer.apply_pending(guestreply)
 
         kws.update({template_object_name: guestreply})
 
-        extra_context = kws.get('extra_context', {})
+        # the url pattern's extra_context is shared by every request.
+        extra_context = dict(kws.get('extra_context') or {})
         extra_context.update(
             dict((k, v)
             for (k, v) in kws.items()
@@ -111,7 +176,46 @@ def validate_please_reply_uri(view):
 
         kws['extra_context'] = extra_context
 
-        return view(request, *args, **kws)
+    @wraps(view)
+    def inner(request, *args, **kws):
+        with primary_reads():
+            response = validate(request, kws)
+            if response is not None:
+                return response
+            return view(request, *args, **kws)
 
     return inner
-    
+
+def reply_etag(reply):
+    """
+    An etag for the reply form of a guest, it changes whenever their reply
+    does (including a reply that is still waiting in the reply buffer).
+    """
+    return '%s-%s-%d%d' % (reply.pk,
+                           reply.modified_at.strftime('%Y%m%d%H%M%S%f'),
+                           reply.responded,
+                           reply.attending)
+
+def conditional_reply_view(view):
+    """
+    wraps a view that is itself wrapped by validate_please_reply_uri and
+    answers conditional GETs with a 304 when the guest's reply hasn't
+    changed, using an ETag and Last-Modified built from Reply.modified_at.
+
+    e.g.
+
+        validate_please_reply_uri(conditional_reply_view(direct_to_template))
+    """
+
+    def reply_in(kws):
+        for value in kws.values():
+            if isinstance(value, Reply):
+                return value
+
+    def etag(request, *args, **kws):
+        return reply_etag(reply_in(kws))
+
+    def last_modified(request, *args, **kws):
+        return reply_in(kws).modified_at
+
+    return condition(etag_func=etag, last_modified_func=last_modified)(view)